@@ -0,0 +1,172 @@
+"""
+Admission control for outbound LLM calls.
+
+Every call through the provider layer takes a slot here first, so a traffic
+spike queues (briefly) instead of turning into provider 429s:
+
+- a global concurrency limit on calls in flight
+- a per-model token bucket, charged with an estimate of the call's tokens
+- a bounded queue with a wait deadline; past either bound the call is shed
+  right away with LLMOverloadedError, which the app returns as a 503
+
+Config:
+- LLM_MAX_CONCURRENCY: calls in flight (default 16)
+- LLM_MAX_QUEUE: calls allowed to wait for a slot (default 64)
+- LLM_QUEUE_TIMEOUT: seconds a call may wait before being shed (default 10)
+- LLM_TOKENS_PER_MINUTE: default per-model budget, 0 = unlimited
+- LLM_MODEL_TOKENS_PER_MINUTE: JSON {model: budget} overrides
+- LLM_MAX_RETRIES: retries on provider 429/529 (default 2)
+"""
+import asyncio
+import json
+import os
+import random
+import time
+from contextlib import asynccontextmanager
+from typing import Optional
+
+import httpx
+
+from active_story_service.metrics import llm_queue_wait_seconds
+
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "64"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "10"))
+LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", "0"))
+LLM_MODEL_TOKENS_PER_MINUTE = json.loads(os.getenv("LLM_MODEL_TOKENS_PER_MINUTE", "{}"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+
+# Provider statuses meaning "slow down": rate limited, overloaded
+RETRYABLE_STATUSES = (429, 529)
+
+
+class LLMOverloadedError(Exception):
+    """The call was shed (or kept being rate limited). Maps to HTTP 503."""
+
+    def __init__(self, message: str, retry_after: float = 1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Refills `per_minute` tokens per minute, holding at most one minute's worth."""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def take(self, amount: float, deadline: float):
+        """Wait until `amount` tokens are available, or shed if that would pass the deadline."""
+        amount = min(amount, self.capacity)
+        while True:
+            self._refill()
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return
+            wait = (amount - self.tokens) / self.rate
+            if time.monotonic() + wait > deadline:
+                raise LLMOverloadedError("LLM token budget exhausted", retry_after=wait)
+            await asyncio.sleep(wait)
+
+    def refund(self, amount: float):
+        """Give back tokens taken for a call that never ran."""
+        self.tokens = min(self.capacity, self.tokens + min(amount, self.capacity))
+
+
+class AdmissionController:
+    def __init__(self):
+        self._semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+        self._buckets = {}
+        self.stats = {"admitted": 0, "shed": 0, "retries": 0, "rate_limited": 0,
+                      "queue_depth": 0, "in_flight": 0}
+
+    def _bucket(self, model: str) -> Optional[TokenBucket]:
+        per_minute = LLM_MODEL_TOKENS_PER_MINUTE.get(model, LLM_TOKENS_PER_MINUTE)
+        if not per_minute:
+            return None
+        if model not in self._buckets:
+            self._buckets[model] = TokenBucket(per_minute)
+        return self._buckets[model]
+
+    def _shed(self, message: str, retry_after: float = 1.0):
+        self.stats["shed"] += 1
+        raise LLMOverloadedError(message, retry_after=retry_after)
+
+    @asynccontextmanager
+    async def slot(self, model: str, tokens: int, deadline: Optional[float] = None):
+        """
+        Hold a concurrency slot and `tokens` of the model's budget for one call.
+        The budget is taken before the slot, both under one wait deadline
+        (`deadline`, time.monotonic(); at most LLM_QUEUE_TIMEOUT from now).
+        """
+        if self.stats["queue_depth"] >= LLM_MAX_QUEUE:
+            self._shed("LLM queue is full")
+        deadline = min(deadline or float("inf"), time.monotonic() + LLM_QUEUE_TIMEOUT)
+        started = time.perf_counter()
+        self.stats["queue_depth"] += 1
+        try:
+            # Budget first: a call waiting for tokens must not sit on a concurrency slot
+            bucket = self._bucket(model)
+            if bucket is not None:
+                try:
+                    await bucket.take(tokens, deadline)
+                except LLMOverloadedError:
+                    self.stats["shed"] += 1
+                    raise
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), timeout=max(0.0, deadline - time.monotonic()))
+            except asyncio.TimeoutError:
+                if bucket is not None:
+                    bucket.refund(tokens)
+                self._shed("Timed out waiting for an LLM slot")
+        finally:
+            self.stats["queue_depth"] -= 1
+            llm_queue_wait_seconds.observe(time.perf_counter() - started, model=model)
+
+        self.stats["admitted"] += 1
+        self.stats["in_flight"] += 1
+        try:
+            yield
+        finally:
+            self.stats["in_flight"] -= 1
+            self._semaphore.release()
+
+
+_controller = AdmissionController()
+
+
+def get_admission_controller() -> AdmissionController:
+    return _controller
+
+
+def estimate_tokens(system, messages, max_tokens: int) -> int:
+    """Rough token count for budgeting: ~4 characters per input token, plus the output cap."""
+    chars = len(str(system)) + sum(len(str(m.get("content", ""))) for m in messages)
+    return chars // 4 + max_tokens
+
+
+def retry_delay(error: Exception, attempt: int) -> Optional[float]:
+    """
+    Seconds to wait before retrying `error`, or None if it isn't retryable.
+    Honors retry-after; otherwise exponential backoff with full jitter.
+    """
+    if not isinstance(error, httpx.HTTPStatusError) or error.response.status_code not in RETRYABLE_STATUSES:
+        return None
+    retry_after = error.response.headers.get("retry-after")
+    try:
+        if retry_after is not None:
+            return float(retry_after) + random.uniform(0, 0.25)
+    except ValueError:
+        pass
+    return random.uniform(0, min(8.0, 0.5 * 2 ** attempt))
+
+
+def get_admission_stats() -> dict:
+    return dict(_controller.stats)
@@ -0,0 +1,205 @@
+"""
+Async LangGraph checkpointer for the V2 Story System.
+
+Motor-backed replacement for MongoDBSaver, so checkpoint reads and writes
+inside graph.ainvoke never block the event loop. It shares the service's
+Motor connection pool (mongo.py) and uses the same document layout as
+MongoDBSaver, so existing checkpoints and the db_crud helpers keep working:
+
+- checkpoints: thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id,
+  type, checkpoint, metadata
+- checkpoint_writes: thread_id, checkpoint_ns, checkpoint_id, task_id,
+  task_path, idx, channel, type, value
+
+Only the async interface is implemented; the graph is always run with
+ainvoke / astream_events.
+"""
+from typing import Any, AsyncIterator, Dict, Optional, Sequence, Tuple
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    get_checkpoint_id,
+)
+from pymongo import UpdateOne
+
+from active_story_service.metrics import timed, checkpoint_seconds
+
+
+def _dumps_metadata(serde, value):
+    """
+    Serialize metadata the way MongoDBSaver stores it: dict keys stay plain
+    strings (so metadata can be filtered on), every leaf is serde-typed.
+    """
+    if isinstance(value, dict):
+        return {key: _dumps_metadata(serde, v) for key, v in value.items()}
+    return serde.dumps_typed(value)
+
+
+def _loads_metadata(serde, value):
+    if isinstance(value, dict):
+        return {key: _loads_metadata(serde, v) for key, v in value.items()}
+    return serde.loads_typed(tuple(value))
+
+
+class MotorSaver(BaseCheckpointSaver):
+    """Checkpointer storing LangGraph checkpoints in MongoDB through Motor."""
+
+    def __init__(self, get_database, serde=None):
+        """
+        get_database returns the Motor database. It is resolved per call, so
+        the pool can be created (and recreated) by the app lifespan.
+        """
+        super().__init__(serde=serde)
+        self._get_database = get_database
+
+    @property
+    def checkpoint_collection(self):
+        return self._get_database().get_collection("checkpoints")
+
+    @property
+    def writes_collection(self):
+        return self._get_database().get_collection("checkpoint_writes")
+
+    async def _pending_writes(self, thread_id: str, checkpoint_ns: str, checkpoint_id: str):
+        cursor = self.writes_collection.find(
+            {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint_id}
+        ).sort([("task_id", 1), ("idx", 1)])
+        return [
+            (wrt["task_id"], wrt["channel"], self.serde.loads_typed((wrt["type"], wrt["value"])))
+            async for wrt in cursor
+        ]
+
+    async def _to_tuple(self, doc: Dict[str, Any]) -> CheckpointTuple:
+        thread_id = doc["thread_id"]
+        checkpoint_ns = doc.get("checkpoint_ns", "")
+        config_values = {
+            "thread_id": thread_id,
+            "checkpoint_ns": checkpoint_ns,
+            "checkpoint_id": doc["checkpoint_id"],
+        }
+        parent_config = None
+        if doc.get("parent_checkpoint_id"):
+            parent_config = {"configurable": {
+                "thread_id": thread_id,
+                "checkpoint_ns": checkpoint_ns,
+                "checkpoint_id": doc["parent_checkpoint_id"],
+            }}
+        return CheckpointTuple(
+            {"configurable": config_values},
+            self.serde.loads_typed((doc["type"], doc["checkpoint"])),
+            _loads_metadata(self.serde, doc.get("metadata", {})),
+            parent_config,
+            await self._pending_writes(thread_id, checkpoint_ns, doc["checkpoint_id"]),
+        )
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        """Load a checkpoint (the latest one unless config names one) with its pending writes."""
+        with timed(checkpoint_seconds, "checkpoint.load", op="load"):
+            query = {
+                "thread_id": config["configurable"]["thread_id"],
+                "checkpoint_ns": config["configurable"].get("checkpoint_ns", ""),
+            }
+            if checkpoint_id := get_checkpoint_id(config):
+                query["checkpoint_id"] = checkpoint_id
+            doc = await self.checkpoint_collection.find_one(query, sort=[("checkpoint_id", -1)])
+            if not doc:
+                return None
+            return await self._to_tuple(doc)
+
+    async def alist(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[Dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> AsyncIterator[CheckpointTuple]:
+        """List checkpoints, newest first."""
+        query = {}
+        if config is not None:
+            query["thread_id"] = config["configurable"]["thread_id"]
+            checkpoint_ns = config["configurable"].get("checkpoint_ns")
+            if checkpoint_ns is not None:
+                query["checkpoint_ns"] = checkpoint_ns
+        for key, value in (filter or {}).items():
+            query[f"metadata.{key}"] = _dumps_metadata(self.serde, value)
+        if before is not None:
+            query["checkpoint_id"] = {"$lt": before["configurable"]["checkpoint_id"]}
+
+        cursor = self.checkpoint_collection.find(query).sort("checkpoint_id", -1)
+        if limit:
+            cursor = cursor.limit(limit)
+        async for doc in cursor:
+            yield await self._to_tuple(doc)
+
+    async def aput(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        """Save a checkpoint. One upsert."""
+        with timed(checkpoint_seconds, "checkpoint.save", op="save"):
+            thread_id = config["configurable"]["thread_id"]
+            checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+            type_, serialized = self.serde.dumps_typed(checkpoint)
+            await self.checkpoint_collection.update_one(
+                {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint["id"]},
+                {"$set": {
+                    "parent_checkpoint_id": config["configurable"].get("checkpoint_id"),
+                    "type": type_,
+                    "checkpoint": serialized,
+                    "metadata": _dumps_metadata(self.serde, metadata),
+                }},
+                upsert=True
+            )
+            return {"configurable": {
+                "thread_id": thread_id,
+                "checkpoint_ns": checkpoint_ns,
+                "checkpoint_id": checkpoint["id"],
+            }}
+
+    async def aput_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[Tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        """Save a task's pending writes. All of them go in one bulk_write round trip."""
+        if not writes:
+            return
+        with timed(checkpoint_seconds, "checkpoint.save_writes", op="save_writes"):
+            thread_id = config["configurable"]["thread_id"]
+            checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+            checkpoint_id = config["configurable"]["checkpoint_id"]
+            # Special channels (errors, interrupts, ...) overwrite; regular writes are set once
+            set_method = "$set" if all(channel in WRITES_IDX_MAP for channel, _ in writes) else "$setOnInsert"
+            operations = []
+            for idx, (channel, value) in enumerate(writes):
+                type_, serialized = self.serde.dumps_typed(value)
+                operations.append(UpdateOne(
+                    {
+                        "thread_id": thread_id,
+                        "checkpoint_ns": checkpoint_ns,
+                        "checkpoint_id": checkpoint_id,
+                        "task_id": task_id,
+                        "task_path": task_path,
+                        "idx": WRITES_IDX_MAP.get(channel, idx),
+                    },
+                    {set_method: {"channel": channel, "type": type_, "value": serialized}},
+                    upsert=True
+                ))
+            await self.writes_collection.bulk_write(operations, ordered=False)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        """Delete every checkpoint and write of a thread."""
+        await self.checkpoint_collection.delete_many({"thread_id": thread_id})
+        await self.writes_collection.delete_many({"thread_id": thread_id})
@@ -0,0 +1,57 @@
+"""
+Per-turn deadline budget for the V2 Story System.
+
+A turn gets one overall budget (TURN_DEADLINE_SECONDS). Each LLM call is
+allowed a share of whatever remains when it starts, so a slow WorldBuilder
+leaves the Storyteller less time instead of pushing the turn past its
+deadline. Nodes degrade when their call times out (fallback world, skipped
+extraction) rather than failing the turn.
+
+Calls outside a turn budget (V1, scripts) use LLM_TIMEOUT.
+"""
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+TURN_DEADLINE_SECONDS = float(os.getenv("TURN_DEADLINE_SECONDS", "45"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+
+# Share of the remaining turn budget each node's LLM call may use
+NODE_BUDGET_SHARES = {
+    "world_builder": 0.35,
+    "storyteller": 0.7,
+    "extractor": 1.0,
+}
+
+# time.monotonic() by which the current turn must finish
+_deadline: ContextVar[Optional[float]] = ContextVar("story_turn_deadline", default=None)
+
+
+class LLMTimeoutError(TimeoutError):
+    """An LLM call ran out of its share of the turn budget."""
+
+
+@contextmanager
+def turn_deadline(seconds: Optional[float] = TURN_DEADLINE_SECONDS):
+    """Run a block under a fresh turn budget (None: no budget)."""
+    token = _deadline.set(time.monotonic() + seconds if seconds is not None else None)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """Seconds left in the current turn's budget, or None outside a turn."""
+    deadline = _deadline.get()
+    return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+
+def call_timeout(node: str) -> float:
+    """Timeout for an LLM call made by `node` right now."""
+    left = remaining()
+    if left is None:
+        return LLM_TIMEOUT
+    return min(LLM_TIMEOUT, left * NODE_BUDGET_SHARES.get(node, 1.0))
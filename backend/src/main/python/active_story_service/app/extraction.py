@@ -0,0 +1,182 @@
+"""
+Deferred extraction for the V2 Story System.
+
+In deferred mode the graph pauses before the Extractor so the storyteller's
+text can go back to the child right away. The Extractor then finishes in the
+background by resuming the paused run, which commits its state update to the
+checkpoint.
+
+Ordering guarantee: a thread's next turn calls settle_thread() first, which
+waits for (or runs) any pending extraction, so it never reads stale
+story_state.
+
+With TURN_LOCK_BACKEND=mongo the extraction outlives the turn lease, so it
+holds its own lease ("<thread_id>:extraction" in turn_leases), renewed
+until the state update has committed. Another worker's settle_thread()
+waits for that lease instead of resuming the same run a second time.
+
+A failed extraction is retried EXTRACTION_MAX_ATTEMPTS times (default 3).
+If it still fails the thread stays paused before the Extractor and
+settle_thread() raises ExtractionFailedError, so the next turn is refused
+(and can be retried) rather than written on top of stale story_state.
+"""
+import asyncio
+import os
+import time
+import uuid
+from typing import Optional
+
+from active_story_service.db_crud import acquire_turn_lease, release_turn_lease
+from active_story_service.metrics import turn_trace
+from .deadlines import turn_deadline
+from .turn_coordinator import TURN_LOCK_BACKEND, TURN_LEASE_SECONDS, TURN_LEASE_WAIT_SECONDS, TurnBusyError
+
+EXTRACTION_MAX_ATTEMPTS = int(os.getenv("EXTRACTION_MAX_ATTEMPTS", "3"))
+# How often settle_thread re-checks an extraction another worker is running
+EXTRACTION_POLL_SECONDS = 0.25
+
+# thread_id -> background task resuming that thread's paused extraction
+_pending = {}
+
+_stats = {"completed": 0, "retries": 0, "failed": 0}
+
+
+class ExtractionFailedError(Exception):
+    """A thread's deferred extraction kept failing; its next turn can't run yet."""
+
+
+def _config(thread_id: str) -> dict:
+    return {"configurable": {"thread_id": thread_id}}
+
+
+def _lease_id(thread_id: str) -> str:
+    return f"{thread_id}:extraction"
+
+
+async def _claim(thread_id: str) -> Optional[str]:
+    """Take the thread's extraction lease. Returns its owner, or None if another worker holds it."""
+    if TURN_LOCK_BACKEND != "mongo":
+        return "local"
+    owner = uuid.uuid4().hex
+    if await acquire_turn_lease(_lease_id(thread_id), owner, TURN_LEASE_SECONDS):
+        return owner
+    return None
+
+
+async def _renew(thread_id: str, owner: str):
+    while True:
+        await asyncio.sleep(TURN_LEASE_SECONDS / 3)
+        try:
+            await acquire_turn_lease(_lease_id(thread_id), owner, TURN_LEASE_SECONDS)
+        except Exception as e:
+            print(f"Failed to renew extraction lease for {thread_id}: {e}")
+
+
+async def _run_extraction(graph, thread_id: str, owner: str, on_complete=None):
+    renewer = asyncio.create_task(_renew(thread_id, owner)) if TURN_LOCK_BACKEND == "mongo" else None
+    try:
+        for attempt in range(EXTRACTION_MAX_ATTEMPTS):
+            try:
+                # Resuming with no input continues the paused run from the Extractor,
+                # with its own budget rather than what is left of the turn that scheduled it
+                with turn_deadline():
+                    async with turn_trace(thread_id, "deferred_extraction"):
+                        result = await graph.ainvoke(None, config=_config(thread_id))
+                break
+            except Exception as e:
+                print(f"Deferred extraction failed for {thread_id} (attempt {attempt + 1}): {e}")
+                if attempt + 1 == EXTRACTION_MAX_ATTEMPTS:
+                    import traceback
+                    traceback.print_exc()
+                    _stats["failed"] += 1
+                    raise ExtractionFailedError(
+                        f"Story state update failed for {thread_id}, please retry: {e}"
+                    ) from e
+                _stats["retries"] += 1
+                await asyncio.sleep(0.5 * 2 ** attempt)
+        _stats["completed"] += 1
+        if on_complete is not None:
+            try:
+                await on_complete(thread_id, result)
+            except Exception as e:
+                # The state update has committed; only the summary is behind
+                print(f"Post-extraction hook failed for {thread_id}: {e}")
+    finally:
+        if renewer is not None:
+            renewer.cancel()
+            try:
+                await release_turn_lease(_lease_id(thread_id), owner)
+            except Exception as e:
+                # The lease expires on its own
+                print(f"Failed to release extraction lease for {thread_id}: {e}")
+
+
+async def schedule_extraction(graph, thread_id: str, on_complete=None) -> Optional[asyncio.Task]:
+    """
+    Finish a paused turn's extraction in the background.
+    on_complete(thread_id, final_values) is awaited once it has committed.
+    Returns None if another worker is already running it.
+    """
+    task = _pending.get(thread_id)
+    if task is not None:
+        return task
+
+    owner = await _claim(thread_id)
+    if owner is None:
+        return None
+    task = _pending.get(thread_id)
+    if task is not None:
+        # Scheduled here while we were claiming
+        if owner != "local":
+            await release_turn_lease(_lease_id(thread_id), owner)
+        return task
+
+    task = asyncio.create_task(_run_extraction(graph, thread_id, owner, on_complete))
+    _pending[thread_id] = task
+
+    def _forget(t):
+        if _pending.get(thread_id) is t:
+            del _pending[thread_id]
+        if not t.cancelled():
+            # Retrieved here so an extraction nobody waits on doesn't log "never retrieved";
+            # the next turn's settle_thread finds the thread still paused and tries again
+            t.exception()
+
+    task.add_done_callback(_forget)
+    return task
+
+
+async def settle_thread(graph, thread_id: str, on_complete=None):
+    """
+    Make sure the previous turn of a thread has been fully extracted.
+    Also picks up runs left paused by a restart, by a failed extraction or
+    by a worker whose extraction lease expired, via the checkpoint.
+    Raises ExtractionFailedError if the extraction still fails.
+    """
+    task = _pending.get(thread_id)
+    deadline = time.monotonic() + TURN_LEASE_WAIT_SECONDS
+    while task is None:
+        snapshot = await graph.aget_state(_config(thread_id))
+        if "extractor" not in (snapshot.next or ()):
+            return
+        task = await schedule_extraction(graph, thread_id, on_complete)
+        if task is None:
+            # Another worker is finishing it; wait for its commit
+            if time.monotonic() > deadline:
+                raise TurnBusyError(f"Thread {thread_id} is still extracting on another worker")
+            await asyncio.sleep(EXTRACTION_POLL_SECONDS)
+    # Shield so a cancelled request doesn't cancel the shared extraction
+    await asyncio.shield(task)
+
+
+async def drain_pending_extractions():
+    """Wait for all background extractions. Called on app shutdown."""
+    tasks = list(_pending.values())
+    if tasks:
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def get_extraction_stats() -> dict:
+    stats = dict(_stats)
+    stats["pending"] = len(_pending)
+    return stats
@@ -0,0 +1,214 @@
+"""
+Tolerant JSON parsing for WorldBuilder and Extractor replies.
+
+The models are asked for bare JSON but sometimes add a preamble, wrap it in
+a markdown fence, or get cut off by max_tokens. Instead of throwing the
+whole reply away:
+
+- the first JSON object is pulled out of the reply, ignoring surrounding text
+- a truncated object is closed at its last complete value (parse_partial_json),
+  and only the top-level keys whose values were complete are kept
+- the result is validated against a Pydantic schema (World, StateUpdate)
+
+parse_updates returns only the keys the reply actually set, so a caller can
+tell a missing tension (keep the old one) from an explicit null.
+
+parse_partial_json also works on a reply that is still streaming, so a
+caller can act as soon as the fields it needs are complete.
+
+Every parse is counted in story_llm_json_parse_total by node and outcome
+(ok, repaired, invalid, early).
+"""
+import json
+import re
+from typing import List, Optional, Set, Tuple
+
+from pydantic import BaseModel, ConfigDict, ValidationError
+
+from active_story_service.metrics import llm_json_parse
+
+_FENCE = re.compile(r"```(?:json)?\s*(.*?)(?:```|$)", re.DOTALL)
+_decoder = json.JSONDecoder()
+
+
+class Character(BaseModel):
+    model_config = ConfigDict(extra="ignore", coerce_numbers_to_str=True)
+
+    name: str
+    who: str = ""
+    feeling: str = ""
+    wants: str = ""
+
+
+class World(BaseModel):
+    """WorldBuilder output."""
+    model_config = ConfigDict(extra="ignore")
+
+    setting: str
+    characters: List[Character]
+    tension: Optional[str] = None
+
+
+class StateUpdate(BaseModel):
+    """Extractor output."""
+    model_config = ConfigDict(extra="ignore")
+
+    characters: List[Character] = []
+    relationships: List[str] = []
+    tension: Optional[str] = None
+
+
+def _strip_fence(raw: str) -> str:
+    match = _FENCE.search(raw)
+    return match.group(1) if match else raw
+
+
+def parse_partial_json(text: str) -> Tuple[Optional[dict], Set[str]]:
+    """
+    Parse the first JSON object in `text`, even if it is unfinished.
+    The object is cut at its last complete value and closed. Returns
+    (object or None, top-level keys whose values are complete).
+    """
+    start = text.find("{")
+    if start < 0:
+        return None, set()
+
+    # One frame per open container: [closer, whether an object key comes next]
+    stack = []
+    in_string = escaped = False
+    in_literal = False  # inside a bare number, true, false or null
+    string_is_key = False
+    key_start = None
+    current_key = None
+    complete = set()
+    cut = None  # (end index, closers, completed keys) of the last complete value
+
+    def value_done(end: int):
+        nonlocal cut
+        if len(stack) == 1 and current_key is not None:
+            complete.add(current_key)
+        cut = (end, "".join(frame[0] for frame in reversed(stack)), set(complete))
+
+    for i in range(start, len(text)):
+        ch = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+                if string_is_key:
+                    if len(stack) == 1:
+                        current_key = json.loads(text[key_start:i + 1])
+                else:
+                    value_done(i + 1)
+            continue
+        if in_literal:
+            if ch not in " \t\r\n,}]":
+                continue
+            # A bare literal ends at whitespace or the next delimiter
+            in_literal = False
+            value_done(i)
+        if ch == '"':
+            in_string = True
+            string_is_key = bool(stack) and stack[-1][0] == "}" and stack[-1][1]
+            key_start = i
+        elif ch in "{[":
+            stack.append(["}" if ch == "{" else "]", ch == "{"])
+        elif ch in "}]":
+            if not stack:
+                break
+            stack.pop()
+            if not stack:
+                cut = (i + 1, "", set(complete))
+                break
+            value_done(i + 1)
+        elif ch == ":":
+            if stack:
+                stack[-1][1] = False
+        elif ch == ",":
+            if stack and stack[-1][0] == "}":
+                stack[-1][1] = True
+        elif ch not in " \t\r\n" and stack:
+            in_literal = True
+
+    if cut is None:
+        return None, set()
+    end, closers, keys = cut
+    try:
+        value = json.loads(text[start:end] + closers)
+    except json.JSONDecodeError:
+        return None, set()
+    return (value if isinstance(value, dict) else None), keys
+
+
+def extract_json(raw: str) -> Tuple[Optional[dict], bool]:
+    """
+    The first JSON object in an LLM reply, ignoring fences and any text
+    around it. Returns (object or None, whether it had to be repaired).
+    A repaired object holds only the top-level keys that were complete.
+    """
+    text = _strip_fence(raw)
+    start = text.find("{")
+    if start >= 0:
+        try:
+            value, _ = _decoder.raw_decode(text, start)
+            if isinstance(value, dict):
+                return value, False
+        except json.JSONDecodeError:
+            pass
+    value, complete = parse_partial_json(text)
+    if value is None:
+        return None, False
+    # Drop the value that was cut off (a half-built character list, a clipped string)
+    return {k: v for k, v in value.items() if k in complete}, True
+
+
+def _validate(raw: str, schema, node: str, only_set: bool = False) -> Optional[dict]:
+    value, repaired = extract_json(raw)
+    if value is None:
+        llm_json_parse.inc(node=node, outcome="invalid")
+        print(f"{node}: no JSON object in reply: {raw[:200]!r}")
+        return None
+    try:
+        model = schema.model_validate(value)
+        parsed = model.model_dump()
+        if only_set:
+            # Like exclude_unset, but only at the top level: characters keep their defaults
+            parsed = {k: v for k, v in parsed.items() if k in model.model_fields_set}
+    except ValidationError as e:
+        llm_json_parse.inc(node=node, outcome="invalid")
+        print(f"{node}: reply doesn't match {schema.__name__}: {e.errors()[:3]}")
+        return None
+    llm_json_parse.inc(node=node, outcome="repaired" if repaired else "ok")
+    return parsed
+
+
+def parse_world(raw: str, node: str = "world_builder") -> Optional[dict]:
+    """A validated world dict from a WorldBuilder reply, or None."""
+    return _validate(raw, World, node)
+
+
+def parse_world_early(partial_raw: str) -> Optional[dict]:
+    """
+    A world from a WorldBuilder reply that is still streaming, once its
+    setting and characters are complete; None until then.
+    """
+    value, complete = parse_partial_json(_strip_fence(partial_raw))
+    if value is None or not {"setting", "characters"} <= complete:
+        return None
+    try:
+        world = World.model_validate(value).model_dump()
+    except ValidationError:
+        return None
+    llm_json_parse.inc(node="world_builder", outcome="early")
+    return world
+
+
+def parse_updates(raw: str, node: str = "extractor") -> Optional[dict]:
+    """
+    A validated state update dict from an Extractor reply, or None. Keys
+    the reply didn't set (or that were cut off) are left out.
+    """
+    return _validate(raw, StateUpdate, node, only_set=True)
@@ -1,6 +1,7 @@
-import os, httpx
+import os, json, httpx
 from pathlib import Path
 from dotenv import load_dotenv
+from active_story_service.metrics import timed, annotate, llm_call_seconds, llm_tokens
 
 # Load .env from project root
 env_path = Path(__file__).parent.parent.parent.parent.parent.parent.parent / '.env'
@@ -10,28 +11,230 @@ load_dotenv(dotenv_path=env_path)
 HAIKU = "claude-3-haiku-20240307"
 SONNET = "claude-3-haiku-20240307"  # Testing with Haiku first
 
+ANTHROPIC_URL = "https://api.anthropic.com/v1/messages"
 
-async def anthropic_messages(system, messages, max_tokens=600, model=HAIKU):
+# Shared HTTP client, owned by the FastAPI lifespan (see main.py)
+_http_client = None
+
+# Connection reuse counters, see get_http_client_stats()
+_pool_stats = {"requests": 0, "new_connections": 0, "reused_connections": 0,
+               "http2_requests": 0, "http1_requests": 0}
+
+# Token counters per node, see get_usage_stats()
+_usage_stats = {}
+
+# Marks the end of a static prefix the provider may serve from its prompt cache
+CACHE_CONTROL = {"type": "ephemeral"}
+
+
+def _http2_available() -> bool:
+    """HTTP/2 needs the optional `h2` package; fall back to HTTP/1.1 without it."""
+    if os.getenv("LLM_HTTP2", "1") != "1":
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def get_http_client() -> httpx.AsyncClient:
     """
-    Call Anthropic API with specified model.
-    Default is Haiku for speed/cost. Use Sonnet for creative tasks.
+    Get the shared, keep-alive AsyncClient used for every LLM call.
+    Created lazily so scripts that never start the app still work.
+    """
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        limits = httpx.Limits(
+            max_connections=int(os.getenv("LLM_MAX_CONNECTIONS", "20")),
+            max_keepalive_connections=int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "10")),
+            keepalive_expiry=float(os.getenv("LLM_KEEPALIVE_EXPIRY", "60")),
+        )
+        _http_client = httpx.AsyncClient(
+            # Socket-level guard only; each call's overall deadline comes from
+            # deadlines.call_timeout() in the provider layer
+            timeout=float(os.getenv("LLM_TIMEOUT", "60")),
+            limits=limits,
+            http2=_http2_available(),
+        )
+    return _http_client
+
+
+async def close_http_client():
+    """Close the shared client. Called on app shutdown."""
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+
+def get_http_client_stats() -> dict:
+    """
+    Connection reuse counters for the shared LLM client. http2_enabled only
+    says HTTP/2 is offered; http2_requests/http1_requests count what was negotiated.
     """
+    stats = dict(_pool_stats)
+    stats["http2_enabled"] = _http_client is not None and _http2_available()
+    return stats
+
+
+def _track_connection():
+    """
+    Build an httpcore trace callback for one request.
+    A request that opens a TCP connection paid for a handshake; any other
+    request was served from a pooled keep-alive connection.
+    """
+    opened = False
+
+    async def trace(event_name, info):
+        nonlocal opened
+        if event_name == "connection.connect_tcp.complete":
+            opened = True
+
+    def record(response):
+        _pool_stats["requests"] += 1
+        if response.http_version == "HTTP/2":
+            _pool_stats["http2_requests"] += 1
+        else:
+            _pool_stats["http1_requests"] += 1
+        if opened:
+            _pool_stats["new_connections"] += 1
+        else:
+            _pool_stats["reused_connections"] += 1
+
+    return trace, record
+
+
+def cached_system(system):
+    """
+    Wrap a static system prompt in a content block with a cache breakpoint.
+    Prefixes shorter than the model's minimum cacheable length are simply
+    not cached, so this is always safe to send.
+
+    Note: every system prompt we send today (the V2 prompts in prompts.py
+    and the V1 ones in main.py) is well under Haiku's 2048-token minimum,
+    so these breakpoints produce no cache hits yet; expect cache_read to
+    stay 0 in the usage logs until a prompt grows past the minimum or a
+    model with a lower one (1024 for Sonnet) is used.
+    """
+    if isinstance(system, str):
+        return [{"type": "text", "text": system, "cache_control": CACHE_CONTROL}]
+    return system
+
+
+def log_usage(node, usage):
+    """
+    Log cached vs. uncached input tokens for one LLM call and add them to
+    the per-node totals. Accepts the API's usage dict or an SDK usage object.
+    """
+    if usage is None:
+        return
+    if not isinstance(usage, dict):
+        usage = {k: getattr(usage, k, 0) for k in (
+            "input_tokens", "output_tokens", "cache_read_input_tokens", "cache_creation_input_tokens"
+        )}
+    counts = {
+        "input_tokens": usage.get("input_tokens") or 0,
+        "cache_read_input_tokens": usage.get("cache_read_input_tokens") or 0,
+        "cache_creation_input_tokens": usage.get("cache_creation_input_tokens") or 0,
+        "output_tokens": usage.get("output_tokens") or 0,
+    }
+    totals = _usage_stats.setdefault(node, {"calls": 0, **{k: 0 for k in counts}})
+    totals["calls"] += 1
+    for key, value in counts.items():
+        totals[key] += value
+    llm_tokens.inc(counts["input_tokens"], node=node, kind="input")
+    llm_tokens.inc(counts["cache_read_input_tokens"], node=node, kind="cache_read")
+    llm_tokens.inc(counts["cache_creation_input_tokens"], node=node, kind="cache_write")
+    llm_tokens.inc(counts["output_tokens"], node=node, kind="output")
+    annotate(
+        input_tokens=counts["input_tokens"] + counts["cache_read_input_tokens"] + counts["cache_creation_input_tokens"],
+        cached_input_tokens=counts["cache_read_input_tokens"],
+        output_tokens=counts["output_tokens"],
+    )
+    print(
+        f"LLM usage node={node}: uncached_input={counts['input_tokens']} "
+        f"cache_read={counts['cache_read_input_tokens']} cache_write={counts['cache_creation_input_tokens']} "
+        f"output={counts['output_tokens']}"
+    )
+
+
+def get_usage_stats() -> dict:
+    """Cumulative token counts per node."""
+    return {node: dict(totals) for node, totals in _usage_stats.items()}
+
+
+def _headers():
     api_key = os.getenv("ANTHROPIC_API_KEY")
     if not api_key:
         raise RuntimeError("ANTHROPIC_API_KEY not set")
-    headers = {
+    return {
         "x-api-key": api_key,
         "content-type": "application/json",
         "anthropic-version": "2023-06-01"
     }
+
+
+async def anthropic_messages(system, messages, max_tokens=600, model=HAIKU, node="llm", temperature=None):
+    """
+    Call Anthropic API with specified model.
+    Default is Haiku for speed/cost. Use Sonnet for creative tasks.
+    The system prompt is sent with a cache breakpoint; `node` labels the usage log.
+    """
+    headers = _headers()
     payload = {
         "model": model,
         "max_tokens": max_tokens,
-        "system": system,
+        "system": cached_system(system),
         "messages": messages,
     }
-    async with httpx.AsyncClient(timeout=60) as client:
-        r = await client.post("https://api.anthropic.com/v1/messages", headers=headers, json=payload)
+    if temperature is not None:
+        payload["temperature"] = temperature
+    trace, record = _track_connection()
+    with timed(llm_call_seconds, f"llm.{node}", node=node):
+        r = await get_http_client().post(ANTHROPIC_URL, headers=headers, json=payload, extensions={"trace": trace})
+        record(r)
         r.raise_for_status()
         data = r.json()
-        return "".join(b.get("text","") for b in data.get("content", []) if b.get("type")=="text")
+        log_usage(node, data.get("usage"))
+    return "".join(b.get("text","") for b in data.get("content", []) if b.get("type")=="text")
+
+
+async def anthropic_messages_stream(system, messages, max_tokens=600, model=HAIKU, node="llm", temperature=None):
+    """
+    Streaming version of anthropic_messages.
+    Yields text chunks as the model produces them.
+    """
+    headers = _headers()
+    payload = {
+        "model": model,
+        "max_tokens": max_tokens,
+        "system": cached_system(system),
+        "messages": messages,
+        "stream": True,
+    }
+    if temperature is not None:
+        payload["temperature"] = temperature
+    trace, record = _track_connection()
+    with timed(llm_call_seconds, f"llm.{node}", node=node):
+        async with get_http_client().stream("POST", ANTHROPIC_URL, headers=headers, json=payload, extensions={"trace": trace}) as r:
+            record(r)
+            r.raise_for_status()
+            usage = {}
+            async for line in r.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                event = json.loads(line[len("data:"):].strip())
+                if event.get("type") == "message_start":
+                    # Input token counts arrive up front, output counts at the end
+                    usage.update(event.get("message", {}).get("usage", {}))
+                elif event.get("type") == "message_delta":
+                    usage.update(event.get("usage", {}))
+                elif event.get("type") == "message_stop":
+                    log_usage(node, usage)
+                elif event.get("type") == "content_block_delta":
+                    delta = event.get("delta", {})
+                    if delta.get("type") == "text_delta" and delta.get("text"):
+                        yield delta["text"]
+                elif event.get("type") == "error":
+                    raise RuntimeError(f"Anthropic stream error: {event.get('error')}")
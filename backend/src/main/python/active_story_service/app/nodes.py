@@ -7,8 +7,30 @@ Three nodes with clean responsibilities:
 - Extractor: Updates state from what was written (every turn)
 """
 import json
+import os
+import re
+from contextlib import aclosing
+from langchain_core.callbacks.manager import adispatch_custom_event
 from .prompts import WORLD_BUILDER_SYSTEM, STORYTELLER_SYSTEM, EXTRACTOR_SYSTEM
-from .llm import anthropic_messages, HAIKU
+from .llm import HAIKU
+from .providers import llm_messages, llm_messages_stream, llm_messages_stream_hedged
+from .deadlines import LLMTimeoutError
+from .json_parsing import parse_world, parse_world_early, parse_updates
+from .world_cache import get_or_build_world
+from .reducers import COMPACT_STATE, merge_relationships
+
+# The Storyteller only sees the end of story_so_far
+RECENT_STORY_CHARS = 500
+
+# Custom event name for storyteller tokens, consumed by /story/turn/stream
+STORY_TOKEN_EVENT = "story_token"
+
+# Start the Storyteller once the WorldBuilder's setting and characters are parsed,
+# without waiting for (or keeping) the rest of its reply
+WORLD_EARLY_START = os.getenv("WORLD_EARLY_START", "0") == "1"
+
+# Hedge slow storyteller calls with a second request (costs extra tokens when it fires)
+STORYTELLER_HEDGE = os.getenv("STORYTELLER_HEDGE", "0") == "1"
 
 
 def get_phase_for_turn(turn: int, user_input: str) -> str:
@@ -64,8 +86,8 @@ def format_state_for_prompt(story_state: dict, phase: str = "rising") -> str:
     if story_state.get("story_so_far"):
         # Only include the last ~500 chars to avoid context bloat and long-form mimicry
         story_so_far = story_state['story_so_far']
-        if len(story_so_far) > 500:
-            parts.append(f"RECENT STORY (last part):\n...{story_so_far[-500:]}")
+        if len(story_so_far) > RECENT_STORY_CHARS:
+            parts.append(f"RECENT STORY (last part):\n...{story_so_far[-RECENT_STORY_CHARS:]}")
         else:
             parts.append(f"STORY SO FAR:\n{story_so_far}")
 
@@ -77,9 +99,45 @@ def format_state_for_prompt(story_state: dict, phase: str = "rising") -> str:
     return "\n\n".join(parts)
 
 
+async def build_world(theme: str, early: bool = False):
+    """
+    Ask the WorldBuilder for a world for this theme.
+    Returns None if the reply had no usable world or the call timed out.
+    With `early`, the reply is streamed and returned as soon as setting
+    and characters are complete (tension may then be missing).
+    """
+    prompt = f'Create a world for this children\'s story theme: "{theme}"'
+    request = (
+        WORLD_BUILDER_SYSTEM,
+        [{"role": "user", "content": prompt}],
+    )
+
+    try:
+        if not early:
+            raw = await llm_messages(*request, max_tokens=500, model=HAIKU, node="world_builder")
+        else:
+            chunks = []
+            async with aclosing(llm_messages_stream(*request, max_tokens=500, model=HAIKU,
+                                                    node="world_builder")) as stream:
+                async for chunk in stream:
+                    chunks.append(chunk)
+                    world = parse_world_early("".join(chunks))
+                    if world is not None:
+                        print("WorldBuilder: setting and characters ready, starting early")
+                        return world
+            raw = "".join(chunks)
+    except LLMTimeoutError as e:
+        # Out of budget: the caller falls back to a generic world
+        print(f"WorldBuilder timed out: {e}")
+        return None
+
+    return parse_world(raw)
+
+
 async def world_builder_node(state):
     """
     Turn 1 only: Create the initial world from user's theme.
+    Uses the speculative world cache when the theme was prewarmed.
     """
     print(f"\n=== WORLD_BUILDER ===")
     print(f"Input state: turn={state.get('turn')}, phase={state.get('phase')}")
@@ -88,18 +146,8 @@ async def world_builder_node(state):
     last_msg = state["messages"][-1]
     theme = last_msg["content"] if isinstance(last_msg, dict) else last_msg.content
 
-    prompt = f'Create a world for this children\'s story theme: "{theme}"'
-
-    raw = await anthropic_messages(
-        WORLD_BUILDER_SYSTEM,
-        [{"role": "user", "content": prompt}],
-        max_tokens=500,
-        model=HAIKU
-    )
-
-    try:
-        world = json.loads(raw)
-    except json.JSONDecodeError:
+    world = await get_or_build_world(theme, lambda t: build_world(t, early=WORLD_EARLY_START))
+    if world is None:
         # Fallback
         world = {
             "setting": "a magical place",
@@ -109,11 +157,12 @@ async def world_builder_node(state):
 
     # Build initial story state
     new_story_state = {
-        "setting": world.get("setting", "a magical place"),
-        "characters": world.get("characters", []),
+        "theme": theme,
+        "setting": world.get("setting") or "a magical place",
+        "characters": world.get("characters") or [],
         "relationships": [],
         "story_so_far": "",
-        "tension": world.get("tension", "an adventure begins"),
+        "tension": world.get("tension") or "an adventure begins",
     }
 
     result = {
@@ -169,12 +218,29 @@ Write the next part of the story. End at a natural pause point where the child c
     # Resolution gets more to wrap up properly
     max_tokens = 250 if phase == "resolution" else 200
 
-    story = await anthropic_messages(
-        STORYTELLER_SYSTEM,
-        [{"role": "user", "content": prompt}],
-        max_tokens=max_tokens,
-        model=HAIKU
-    )
+    # Stream tokens out as custom events so streaming callers can forward them;
+    # plain ainvoke callers just get the joined text
+    chunks = []
+    stream = llm_messages_stream_hedged if STORYTELLER_HEDGE else llm_messages_stream
+    try:
+        async for chunk in stream(
+            STORYTELLER_SYSTEM,
+            [{"role": "user", "content": prompt}],
+            max_tokens=max_tokens,
+            model=HAIKU,
+            node="storyteller"
+        ):
+            chunks.append(chunk)
+            await adispatch_custom_event(STORY_TOKEN_EVENT, {"text": chunk})
+    except LLMTimeoutError:
+        # Nothing to tell without any text; otherwise keep the complete sentences
+        partial = "".join(chunks)
+        match = re.search(r"^.*[.!?][\"'”’)]*", partial, re.DOTALL)
+        if not match:
+            raise
+        print(f"Storyteller timed out, keeping {len(match.group(0))} of {len(partial)} chars")
+        chunks = [match.group(0)]
+    story = "".join(chunks)
 
     print(f"Story output (first 100 chars): {story[:100]}...")
     return {"messages": [{"role": "assistant", "content": story}]}
@@ -253,21 +319,24 @@ Story segment just written:
 
 Update the state based on what happened. The tension should reflect the child's intention."""
 
-    raw = await anthropic_messages(
-        EXTRACTOR_SYSTEM,
-        [{"role": "user", "content": prompt}],
-        max_tokens=400,
-        model=HAIKU
-    )
-
-    print(f"Extractor raw response: {raw[:200]}...")
-
     try:
-        updates = json.loads(raw)
-        print(f"Parsed updates: characters={len(updates.get('characters', []))}, tension={updates.get('tension')}")
-    except json.JSONDecodeError as e:
-        print(f"JSON parse error: {e}")
-        updates = {}
+        raw = await llm_messages(
+            EXTRACTOR_SYSTEM,
+            [{"role": "user", "content": prompt}],
+            max_tokens=400,
+            model=HAIKU,
+            node="extractor"
+        )
+    except LLMTimeoutError as e:
+        # Skip extraction: the segment is still recorded, characters and tension carry over
+        print(f"Extractor timed out, skipping state update: {e}")
+        raw = None
+
+    if raw is not None:
+        print(f"Extractor raw response: {raw[:200]}...")
+    # Unusable reply: like a skipped extraction, characters and tension carry over
+    updates = (parse_updates(raw) if raw is not None else None) or {}
+    print(f"Parsed updates: characters={len(updates.get('characters', []))}, tension={updates.get('tension')}")
 
     # Update story state
     new_story_state = {**story_state}
@@ -278,11 +347,10 @@ Update the state based on what happened. The tension should reflect the child's
 
     # Update relationships
     if updates.get("relationships"):
-        # Merge new relationships with existing
-        existing = set(new_story_state.get("relationships", []))
-        for rel in updates["relationships"]:
-            existing.add(rel)
-        new_story_state["relationships"] = list(existing)
+        # Merge new relationships with existing (bounded in compact mode)
+        new_story_state["relationships"] = merge_relationships(
+            new_story_state.get("relationships", []), updates["relationships"]
+        )
 
     # Append to story so far
     story_so_far = new_story_state.get("story_so_far", "")
@@ -291,14 +359,21 @@ Update the state based on what happened. The tension should reflect the child's
     else:
         new_story_state["story_so_far"] = latest_story
 
-    # Update tension
-    new_story_state["tension"] = updates.get("tension")
+    # In compact mode only keep what the Storyteller can see (the full
+    # transcript is in story_segments). Twice the prompt window, so the
+    # prompt still knows it is looking at the recent part.
+    if COMPACT_STATE:
+        new_story_state["story_so_far"] = new_story_state["story_so_far"][-2 * RECENT_STORY_CHARS:]
+
+    # Update tension (an explicit null clears it; a missing one carries over)
+    if "tension" in updates:
+        new_story_state["tension"] = updates["tension"]
 
     # Determine next phase based on tension, turn, and user input
     next_turn = turn + 1
     next_phase = determine_phase(
         turn=next_turn,
-        tension=new_story_state["tension"],
+        tension=new_story_state.get("tension"),
         user_input=user_input,
         current_phase=current_phase
     )
@@ -5,6 +5,9 @@ Three nodes with clean responsibilities:
 - WorldBuilder: Creates initial world from theme (turn 1 only)
 - Storyteller: Writes story from user input + state (every turn)
 - Extractor: Updates state from what was written (every turn)
+
+Each prompt is sent with a cache breakpoint (llm.cached_system), but all of
+them are far below Haiku's 2048-token minimum, so none is actually cached.
 """
 
 WORLD_BUILDER_SYSTEM = """You create the initial world for a collaborative story.
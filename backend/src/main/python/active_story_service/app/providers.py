@@ -0,0 +1,361 @@
+"""
+LLM provider layer shared by V1 (main.py) and V2 (nodes.py).
+
+Every LLM call goes through llm_messages / llm_messages_stream, which
+take an admission slot (admission.py), retry provider 429/529s, and
+dispatch to the provider selected by LLM_PROVIDER:
+
+- "anthropic" (default): the Messages API through the pooled client in llm.py
+- "stub": an offline, deterministic backend for load tests. It returns
+  valid WorldBuilder / Extractor JSON, storyteller prose and the V1
+  <story> / <story_continuation> tags, with a configurable latency profile.
+  No API key is needed.
+
+Stub config:
+- STUB_LLM_PROFILE: fast | realistic (default) | slow
+- STUB_LLM_TTFT_MS, STUB_LLM_TOKENS_PER_SEC: override the profile
+- STUB_LLM_JITTER: +/- fraction applied to both (default 0.2)
+"""
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import time
+from abc import ABC, abstractmethod
+from contextlib import aclosing
+from typing import AsyncIterator
+
+from active_story_service.metrics import timed, llm_call_seconds, llm_first_token_seconds, llm_timeouts
+from .llm import HAIKU, anthropic_messages, anthropic_messages_stream, log_usage
+from .admission import (
+    LLM_MAX_RETRIES, LLMOverloadedError, get_admission_controller, estimate_tokens, retry_delay
+)
+from .deadlines import LLMTimeoutError, call_timeout
+
+# (time to first token in ms, output tokens per second)
+STUB_PROFILES = {
+    "fast": (20, 1000),
+    "realistic": (600, 80),
+    "slow": (2000, 20),
+}
+
+
+class LLMProvider(ABC):
+    """Interface every backend implements. `node` labels metrics and usage logs."""
+    name = ""
+
+    @abstractmethod
+    async def messages(self, system, messages, max_tokens=600, model=HAIKU, node="llm", temperature=None) -> str:
+        """The full reply text."""
+
+    @abstractmethod
+    def messages_stream(self, system, messages, max_tokens=600, model=HAIKU, node="llm",
+                        temperature=None) -> AsyncIterator[str]:
+        """An async iterator of reply text chunks."""
+
+
+class AnthropicProvider(LLMProvider):
+    name = "anthropic"
+
+    async def messages(self, system, messages, max_tokens=600, model=HAIKU, node="llm", temperature=None) -> str:
+        return await anthropic_messages(system, messages, max_tokens=max_tokens, model=model,
+                                        node=node, temperature=temperature)
+
+    def messages_stream(self, system, messages, max_tokens=600, model=HAIKU, node="llm", temperature=None):
+        return anthropic_messages_stream(system, messages, max_tokens=max_tokens, model=model,
+                                         node=node, temperature=temperature)
+
+
+# ============================================================================
+# Stub backend
+# ============================================================================
+
+_NAMES = ["Pip", "Luna", "Milo", "Juniper", "Otis", "Hazel", "Ziggy", "Wren"]
+_WHO = ["a curious little fox", "a brave young explorer", "a sleepy dragon", "a clever robot"]
+_FEELINGS = ["excited", "nervous", "hopeful", "curious", "determined", "happy"]
+_SENTENCES = [
+    "A soft wind carried the smell of fresh bread across the path.",
+    "Somewhere nearby, something small giggled and then went quiet.",
+    "{name} took a deep breath and stepped a little closer.",
+    "The lanterns flickered as if they were whispering a secret.",
+    "A shiny pebble rolled out from under a leaf and stopped right at {name}'s feet.",
+    "{name} smiled, because this was exactly the kind of adventure worth having.",
+    "Far away, a bell rang three times, slow and friendly.",
+    "The ground wobbled just a tiny bit, like it was trying not to laugh.",
+]
+_ENDINGS = ["the end", "that's it", "done", "finished", "goodbye", "goodnight"]
+
+
+def _last_user_text(messages) -> str:
+    for message in reversed(messages):
+        if message.get("role") == "user":
+            content = message.get("content", "")
+            if isinstance(content, list):
+                return " ".join(block.get("text", "") for block in content if isinstance(block, dict))
+            return content
+    return ""
+
+
+class StubProvider(LLMProvider):
+    """Deterministic offline backend: the same prompt always gets the same reply."""
+    name = "stub"
+
+    def __init__(self):
+        ttft_ms, tokens_per_sec = STUB_PROFILES.get(os.getenv("STUB_LLM_PROFILE", "realistic"),
+                                                    STUB_PROFILES["realistic"])
+        self.ttft = float(os.getenv("STUB_LLM_TTFT_MS", ttft_ms)) / 1000
+        self.tokens_per_sec = float(os.getenv("STUB_LLM_TOKENS_PER_SEC", tokens_per_sec))
+        self.jitter = float(os.getenv("STUB_LLM_JITTER", "0.2"))
+
+    def _rng(self, prompt: str) -> random.Random:
+        return random.Random(hashlib.sha256(prompt.encode("utf-8")).hexdigest())
+
+    def _vary(self, rng: random.Random, value: float) -> float:
+        return max(0.0, value * (1 + rng.uniform(-self.jitter, self.jitter)))
+
+    def _prose(self, rng: random.Random, name: str, sentences: int) -> str:
+        return " ".join(s.format(name=name) for s in rng.sample(_SENTENCES, sentences))
+
+    def _reply(self, prompt: str, node: str, rng: random.Random) -> str:
+        name = rng.choice(_NAMES)
+        if node == "world_builder":
+            match = re.search(r'"(.*)"', prompt)
+            theme = match.group(1) if match else "a faraway place"
+            return json.dumps({
+                "setting": f"a cozy, glowing corner of {theme}",
+                "characters": [{"name": name, "who": rng.choice(_WHO),
+                                "feeling": rng.choice(_FEELINGS), "wants": f"to explore {theme}"}],
+                "tension": f"Something mysterious is hiding in {theme}",
+            })
+        if node == "extractor":
+            match = re.search(r"Previous characters: (.*)", prompt)
+            try:
+                characters = json.loads(match.group(1)) if match else []
+            except json.JSONDecodeError:
+                characters = []
+            characters = [{**c, "feeling": rng.choice(_FEELINGS)} for c in characters] or [
+                {"name": name, "who": rng.choice(_WHO), "feeling": rng.choice(_FEELINGS), "wants": "to find out more"}
+            ]
+            ending = any(signal in prompt.lower() for signal in _ENDINGS)
+            return json.dumps({
+                "characters": characters,
+                "relationships": [f"{characters[0]['name']} trusts the listener"],
+                "tension": None if ending else "What will happen next?",
+            })
+        if node.startswith("v1_continue"):
+            return f"<story_continuation>{self._prose(rng, name, 3)}</story_continuation>"
+        if node.startswith("v1_generate"):
+            return f"<story>{self._prose(rng, name, 4)} And then...</story>"
+        return self._prose(rng, name, rng.randint(2, 3))
+
+    def _usage(self, system, messages, reply: str) -> dict:
+        prompt_chars = len(str(system)) + sum(len(str(m.get("content", ""))) for m in messages)
+        return {"input_tokens": prompt_chars // 4, "output_tokens": len(reply.split())}
+
+    async def messages(self, system, messages, max_tokens=600, model=HAIKU, node="llm", temperature=None) -> str:
+        prompt = _last_user_text(messages)
+        rng = self._rng(prompt)
+        reply = self._reply(prompt, node, rng)
+        with timed(llm_call_seconds, f"llm.{node}", node=node):
+            tokens = len(reply.split())
+            await asyncio.sleep(self._vary(rng, self.ttft) + tokens / self._vary(rng, self.tokens_per_sec))
+            log_usage(node, self._usage(system, messages, reply))
+        return reply
+
+    async def messages_stream(self, system, messages, max_tokens=600, model=HAIKU, node="llm",
+                              temperature=None) -> AsyncIterator[str]:
+        prompt = _last_user_text(messages)
+        rng = self._rng(prompt)
+        reply = self._reply(prompt, node, rng)
+        with timed(llm_call_seconds, f"llm.{node}", node=node):
+            await asyncio.sleep(self._vary(rng, self.ttft))
+            delay = 1 / self._vary(rng, self.tokens_per_sec)
+            words = reply.split(" ")
+            for i, word in enumerate(words):
+                if i:
+                    await asyncio.sleep(delay)
+                yield word if i == len(words) - 1 else word + " "
+            log_usage(node, self._usage(system, messages, reply))
+
+
+_PROVIDERS = {"anthropic": AnthropicProvider, "stub": StubProvider}
+_provider = None
+
+
+def get_provider() -> LLMProvider:
+    """The provider named by LLM_PROVIDER, created on first use."""
+    global _provider
+    if _provider is None:
+        name = os.getenv("LLM_PROVIDER", "anthropic")
+        if name not in _PROVIDERS:
+            raise RuntimeError(f"Unknown LLM_PROVIDER {name!r}; expected one of {sorted(_PROVIDERS)}")
+        _provider = _PROVIDERS[name]()
+        print(f"LLM provider: {name}")
+    return _provider
+
+
+async def _backoff(error: Exception, attempt: int, node: str, deadline: float):
+    """Sleep before a retry, or re-raise if `error` can't be retried."""
+    delay = retry_delay(error, attempt)
+    if delay is None:
+        raise error
+    controller = get_admission_controller()
+    controller.stats["rate_limited"] += 1
+    if attempt >= LLM_MAX_RETRIES or time.monotonic() + delay > deadline:
+        controller.stats["shed"] += 1
+        raise LLMOverloadedError(f"LLM provider is rate limiting ({node})", retry_after=delay) from error
+    controller.stats["retries"] += 1
+    print(f"LLM {node} rate limited, retry {attempt + 1} in {delay:.2f}s")
+    await asyncio.sleep(delay)
+
+
+async def llm_messages(system, messages, max_tokens=600, model=HAIKU, node="llm", temperature=None) -> str:
+    """
+    Complete one prompt with the configured provider.
+    The call (retries included) must finish within deadlines.call_timeout(node).
+    """
+    tokens = estimate_tokens(system, messages, max_tokens)
+    deadline = time.monotonic() + call_timeout(node)
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        try:
+            async with get_admission_controller().slot(model, tokens, deadline=deadline):
+                return await asyncio.wait_for(
+                    get_provider().messages(system, messages, max_tokens=max_tokens, model=model,
+                                            node=node, temperature=temperature),
+                    timeout=max(0.0, deadline - time.monotonic())
+                )
+        except LLMOverloadedError:
+            raise
+        except asyncio.TimeoutError as e:
+            llm_timeouts.inc(node=node)
+            raise LLMTimeoutError(f"LLM call for {node} ran out of its deadline") from e
+        except Exception as e:
+            await _backoff(e, attempt, node, deadline)
+
+
+async def llm_messages_stream(system, messages, max_tokens=600, model=HAIKU, node="llm",
+                              temperature=None) -> AsyncIterator[str]:
+    """
+    Streaming version of llm_messages; yields text chunks.
+    Only a call that fails before its first chunk is retried.
+    """
+    tokens = estimate_tokens(system, messages, max_tokens)
+    deadline = time.monotonic() + call_timeout(node)
+    started_at = time.perf_counter()
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        started = False
+        try:
+            async with get_admission_controller().slot(model, tokens, deadline=deadline):
+                chunks = get_provider().messages_stream(system, messages, max_tokens=max_tokens,
+                                                        model=model, node=node, temperature=temperature)
+                try:
+                    while True:
+                        # The timeout only covers waiting on the provider, never our consumer
+                        try:
+                            chunk = await asyncio.wait_for(
+                                chunks.__anext__(), timeout=max(0.0, deadline - time.monotonic())
+                            )
+                        except StopAsyncIteration:
+                            break
+                        if not started:
+                            started = True
+                            llm_first_token_seconds.observe(time.perf_counter() - started_at, node=node)
+                        yield chunk
+                finally:
+                    await chunks.aclose()
+            return
+        except LLMOverloadedError:
+            raise
+        except asyncio.TimeoutError as e:
+            llm_timeouts.inc(node=node)
+            raise LLMTimeoutError(f"LLM stream for {node} ran out of its deadline") from e
+        except Exception as e:
+            if started:
+                raise
+            await _backoff(e, attempt, node, deadline)
+
+
+# ============================================================================
+# Hedged streaming
+# ============================================================================
+
+# Fire the hedge once the first call is slower than this quantile of past first-token times
+HEDGE_QUANTILE = float(os.getenv("LLM_HEDGE_QUANTILE", "0.95"))
+HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+HEDGE_DEFAULT_DELAY = float(os.getenv("LLM_HEDGE_DEFAULT_DELAY", "1.5"))
+
+_hedge_stats = {"calls": 0, "hedged": 0, "hedge_won": 0}
+
+
+def hedge_delay(node: str) -> float:
+    """How long to wait for the first token before hedging: p95 once we have enough samples."""
+    if llm_first_token_seconds.count(node=node) < HEDGE_MIN_SAMPLES:
+        return HEDGE_DEFAULT_DELAY
+    delay = llm_first_token_seconds.quantile(HEDGE_QUANTILE, node=node)
+    if delay is None or delay == float("inf"):
+        return HEDGE_DEFAULT_DELAY
+    return delay
+
+
+async def _first(chunks):
+    try:
+        return await chunks.__anext__()
+    except StopAsyncIteration:
+        return None
+
+
+async def llm_messages_stream_hedged(system, messages, max_tokens=600, model=HAIKU, node="llm",
+                                     temperature=None) -> AsyncIterator[str]:
+    """
+    llm_messages_stream with a hedge: if no token has arrived after
+    hedge_delay(node), the same request is sent again and whichever stream
+    produces a token first is used. The loser is cancelled.
+    """
+    _hedge_stats["calls"] += 1
+    kwargs = dict(max_tokens=max_tokens, model=model, node=node, temperature=temperature)
+    streams = {}
+    primary = llm_messages_stream(system, messages, **kwargs)
+    streams[asyncio.create_task(_first(primary))] = primary
+    done, _ = await asyncio.wait(streams, timeout=hedge_delay(node))
+    if not done:
+        _hedge_stats["hedged"] += 1
+        print(f"LLM {node} slow to start, hedging")
+        secondary = llm_messages_stream(system, messages, **kwargs)
+        streams[asyncio.create_task(_first(secondary))] = secondary
+
+    winner, first, error = None, None, None
+    pending = set(streams)
+    try:
+        while pending and winner is None:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    error = error or task.exception()
+                elif winner is None:
+                    winner, first = streams[task], task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+        for task, chunks in streams.items():
+            if chunks is not winner:
+                if not task.done():
+                    await asyncio.gather(task, return_exceptions=True)
+                await chunks.aclose()
+
+    if winner is None:
+        raise error
+    if winner is not primary:
+        _hedge_stats["hedge_won"] += 1
+    # Closed here too, so a consumer that stops early frees the admission slot right away
+    async with aclosing(winner):
+        if first is None:
+            return
+        yield first
+        async for chunk in winner:
+            yield chunk
+
+
+def get_hedge_stats() -> dict:
+    return dict(_hedge_stats)
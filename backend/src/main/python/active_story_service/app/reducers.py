@@ -2,7 +2,38 @@
 Reducers for the V2 Agentic Story system.
 
 Note: Most state updates are now handled directly in nodes.py.
-This file kept for potential future utility functions.
+This file holds the message reducer used by StoryState.
 """
+import os
+from langgraph.graph.message import add_messages
 
-# Currently unused - state updates handled in nodes directly
+# Compact state mode: keep checkpoints O(1) in story length.
+# Only a bounded window of messages and the tail of story_so_far stay in
+# graph state; the full transcript lives in the story_segments collection.
+COMPACT_STATE = os.getenv("STORY_COMPACT_STATE", "0") == "1"
+
+# Messages kept in state in compact mode (the latest turn needs two)
+MESSAGE_WINDOW = int(os.getenv("STORY_MESSAGE_WINDOW", "4"))
+
+# Most recent relationships kept in story_state in compact mode
+RELATIONSHIP_WINDOW = int(os.getenv("STORY_RELATIONSHIP_WINDOW", "12"))
+
+
+def add_messages_window(left, right):
+    """add_messages, trimmed to the last MESSAGE_WINDOW messages in compact mode."""
+    merged = add_messages(left, right)
+    if COMPACT_STATE and MESSAGE_WINDOW > 0:
+        return merged[-MESSAGE_WINDOW:]
+    return merged
+
+
+def merge_relationships(existing, new):
+    """
+    Union of relationships in the order they were (last) mentioned, so a
+    repeated one counts as recent. Trimmed to the last RELATIONSHIP_WINDOW
+    in compact mode.
+    """
+    merged = [rel for rel in existing if rel not in new] + list(dict.fromkeys(new))
+    if COMPACT_STATE and RELATIONSHIP_WINDOW > 0:
+        return merged[-RELATIONSHIP_WINDOW:]
+    return merged
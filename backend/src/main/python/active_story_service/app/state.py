@@ -1,9 +1,9 @@
 from typing import Annotated, TypedDict, List, Dict, Any
-from langgraph.graph.message import add_messages
+from .reducers import add_messages_window
 
 
 class StoryState(TypedDict, total=False):
-    messages: Annotated[List[dict], add_messages]
+    messages: Annotated[List[dict], add_messages_window]
     story_state: Dict[str, Any]  # The prose-graph state
     turn: int
     phase: str  # Story arc: "setup", "rising", "climax", "resolution"
@@ -21,6 +21,7 @@ def initial_state() -> StoryState:
     return {
         "messages": [],
         "story_state": {
+            "theme": None,         # The child's first message
             "setting": None,
             "characters": [],      # List of {"name", "who", "feeling", "wants"}
             "relationships": [],   # List of strings: "Big Dog stole from Buddy"
@@ -0,0 +1,149 @@
+"""
+Per-thread turn serialization and request coalescing for the V2 Story System.
+
+Two turns on one thread must never run at once: both would load the same
+checkpoint and one story segment would silently overwrite the other.
+
+- thread_turn(): holds the thread's turn lock. In-process this is an
+  asyncio.Lock; with TURN_LOCK_BACKEND=mongo a lease in the turn_leases
+  collection is also taken, so turns are serialized across workers.
+- run_turn(): additionally coalesces requests carrying the same idempotency
+  key. A duplicate that arrives while the turn is running awaits the same
+  task; one that arrives after it finished gets the stored result. Either
+  way the LLM is only billed once.
+
+Config:
+- TURN_LOCK_BACKEND: "local" (default) or "mongo"
+- TURN_LEASE_SECONDS: lease expiry, longer than any turn (default 120)
+- TURN_LEASE_WAIT_SECONDS: how long to wait for another worker's lease (default 60)
+- IDEMPOTENCY_CACHE_SIZE, IDEMPOTENCY_TTL: finished results kept for replays
+"""
+import asyncio
+import os
+import time
+import uuid
+from contextlib import asynccontextmanager
+
+from active_story_service.db_crud import (
+    acquire_turn_lease, release_turn_lease, get_idempotent_result, save_idempotent_result
+)
+from active_story_service.ttl_cache import TTLCache
+
+TURN_LOCK_BACKEND = os.getenv("TURN_LOCK_BACKEND", "local")
+TURN_LEASE_SECONDS = float(os.getenv("TURN_LEASE_SECONDS", "120"))
+TURN_LEASE_WAIT_SECONDS = float(os.getenv("TURN_LEASE_WAIT_SECONDS", "60"))
+TURN_LEASE_POLL_SECONDS = 0.05
+
+_results = TTLCache(
+    maxsize=int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("IDEMPOTENCY_TTL", "600")),
+)
+
+# thread_id -> [lock, number of turns holding or waiting for it]
+_locks = {}
+
+# (thread_id, idempotency key) -> task running that turn
+_inflight = {}
+
+_stats = {"turns": 0, "lock_waits": 0, "lease_waits": 0, "coalesced": 0, "replayed": 0}
+
+
+class TurnBusyError(Exception):
+    """Another worker held the thread's turn lease for too long."""
+
+
+@asynccontextmanager
+async def _lease(thread_id: str):
+    owner = uuid.uuid4().hex
+    deadline = time.monotonic() + TURN_LEASE_WAIT_SECONDS
+    waited = False
+    while not await acquire_turn_lease(thread_id, owner, TURN_LEASE_SECONDS):
+        if not waited:
+            waited = True
+            _stats["lease_waits"] += 1
+        if time.monotonic() > deadline:
+            raise TurnBusyError(f"Thread {thread_id} is busy with another turn")
+        await asyncio.sleep(TURN_LEASE_POLL_SECONDS)
+    try:
+        yield
+    finally:
+        try:
+            await release_turn_lease(thread_id, owner)
+        except Exception as e:
+            # The lease expires on its own
+            print(f"Failed to release turn lease for {thread_id}: {e}")
+
+
+@asynccontextmanager
+async def thread_turn(thread_id: str):
+    """Hold the thread's turn lock (and lease, with the mongo backend)."""
+    entry = _locks.setdefault(thread_id, [asyncio.Lock(), 0])
+    entry[1] += 1
+    try:
+        lock = entry[0]
+        if lock.locked():
+            _stats["lock_waits"] += 1
+        async with lock:
+            _stats["turns"] += 1
+            if TURN_LOCK_BACKEND == "mongo":
+                async with _lease(thread_id):
+                    yield
+            else:
+                yield
+    finally:
+        entry[1] -= 1
+        if entry[1] == 0:
+            _locks.pop(thread_id, None)
+
+
+async def _run_and_store(thread_id: str, key: str, run) -> dict:
+    async with thread_turn(thread_id):
+        if TURN_LOCK_BACKEND == "mongo":
+            # Another worker may have finished this request while we waited
+            stored = await get_idempotent_result(thread_id, key)
+            if stored is not None:
+                _stats["replayed"] += 1
+                _results.set((thread_id, key), stored)
+                return stored
+        result = await run()
+        _results.set((thread_id, key), result)
+        if TURN_LOCK_BACKEND == "mongo":
+            try:
+                await save_idempotent_result(thread_id, key, result, _results.ttl)
+            except Exception as e:
+                print(f"Failed to store idempotent result for {thread_id}: {e}")
+        return result
+
+
+async def run_turn(thread_id: str, idempotency_key, run) -> dict:
+    """
+    Run `run()` (a coroutine function returning a JSON-able dict) as the
+    thread's next turn. Requests with the same idempotency key share one run.
+    """
+    if not idempotency_key:
+        async with thread_turn(thread_id):
+            return await run()
+
+    key = (thread_id, idempotency_key)
+    cached = _results.get(key)
+    if cached is not None:
+        _stats["replayed"] += 1
+        return cached
+
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_run_and_store(thread_id, idempotency_key, run))
+        _inflight[key] = task
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+    else:
+        _stats["coalesced"] += 1
+    # A client that disconnects doesn't cancel the turn its retry will wait on
+    return await asyncio.shield(task)
+
+
+def get_turn_stats() -> dict:
+    stats = dict(_stats)
+    stats["active_threads"] = len(_locks)
+    stats["inflight_keyed_turns"] = len(_inflight)
+    stats.update({f"results_{k}": v for k, v in _results.stats().items()})
+    return stats
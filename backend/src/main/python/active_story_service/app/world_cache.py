@@ -0,0 +1,89 @@
+"""
+Speculative world building for the V2 Story System.
+
+The UI can submit a draft theme while the child is still typing
+(POST /story/prewarm). The WorldBuilder output is computed in the
+background and cached by normalized theme, so turn 1 can skip the
+WorldBuilder LLM call when the final theme matches.
+"""
+import asyncio
+import copy
+import os
+import re
+
+from active_story_service.ttl_cache import TTLCache
+
+_cache = TTLCache(
+    maxsize=int(os.getenv("WORLD_CACHE_SIZE", "256")),
+    ttl=float(os.getenv("WORLD_CACHE_TTL", "600")),
+)
+
+# normalized theme -> task building that world right now
+_inflight = {}
+
+
+def normalize_theme(theme: str) -> str:
+    """Lowercase, drop punctuation and collapse whitespace."""
+    theme = re.sub(r"[^\w\s]", " ", theme.lower())
+    return " ".join(theme.split())
+
+
+async def _build_and_store(key: str, theme: str, build):
+    try:
+        world = await build(theme)
+        # Failed builds return None and are not cached
+        if world is not None:
+            _cache.set(key, world)
+        return world
+    finally:
+        _inflight.pop(key, None)
+
+
+def _start_build(key: str, theme: str, build) -> asyncio.Task:
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.create_task(_build_and_store(key, theme, build))
+        _inflight[key] = task
+    return task
+
+
+def prewarm(theme: str, build) -> str:
+    """
+    Start building the world for a draft theme in the background.
+    Returns "cached", "warming" or "started".
+    """
+    key = normalize_theme(theme)
+    if not key:
+        return "ignored"
+    if key in _cache:
+        return "cached"
+    if key in _inflight:
+        return "warming"
+    _start_build(key, theme, build)
+    return "started"
+
+
+async def get_or_build_world(theme: str, build):
+    """
+    Get the world for a theme: from cache, from an in-flight prewarm,
+    or by building it now. Returns None if the build failed.
+    The result is a copy, so callers may modify it freely.
+    """
+    key = normalize_theme(theme)
+    world = _cache.get(key, record=False)
+    if world is not None:
+        _cache.hits += 1
+    elif key in _inflight:
+        # A prewarm is already paying for this call; share it
+        _cache.hits += 1
+        world = await asyncio.shield(_inflight[key])
+    else:
+        _cache.misses += 1
+        world = await asyncio.shield(_start_build(key, theme, build))
+    return copy.deepcopy(world)
+
+
+def get_world_cache_stats() -> dict:
+    stats = _cache.stats()
+    stats["inflight"] = len(_inflight)
+    return stats
@@ -0,0 +1,158 @@
+"""
+Content-addressed on-disk cache for text-to-speech audio.
+
+Story text never changes once generated, so audio is stored under
+sha256(model + text) and replays are served straight from disk. The key
+doubles as the HTTP ETag.
+
+Files live in TTS_CACHE_DIR/<key[:2]>/<key>.mp3. An in-memory index keeps
+LRU order (seeded from file mtimes at startup); the oldest files are
+evicted once the cache exceeds TTS_CACHE_MAX_BYTES. Writes go to a temp
+file that is renamed into place, so a reader never sees partial audio.
+"""
+import asyncio
+import hashlib
+import os
+import uuid
+from collections import OrderedDict
+from typing import Optional
+
+import aiofiles
+
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", os.path.join(os.getcwd(), "tts_cache"))
+TTS_CACHE_MAX_BYTES = int(os.getenv("TTS_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+# key -> file size, least recently used first
+_index: "OrderedDict[str, int]" = OrderedDict()
+_loaded = False
+_stats = {"hits": 0, "misses": 0, "bytes_saved": 0, "evictions": 0, "writes": 0}
+
+
+def audio_key(model: str, text: str) -> str:
+    return hashlib.sha256(f"{model}\n{text}".encode("utf-8")).hexdigest()
+
+
+def audio_path(key: str) -> str:
+    return os.path.join(TTS_CACHE_DIR, key[:2], f"{key}.mp3")
+
+
+def _scan():
+    entries = []
+    if os.path.isdir(TTS_CACHE_DIR):
+        for root, _, files in os.walk(TTS_CACHE_DIR):
+            for name in files:
+                if not name.endswith(".mp3"):
+                    continue
+                stat = os.stat(os.path.join(root, name))
+                entries.append((stat.st_mtime, name[:-len(".mp3")], stat.st_size))
+    return sorted(entries)
+
+
+async def load_index():
+    """Rebuild the LRU index from disk. Called on app startup (or on first use)."""
+    global _loaded
+    entries = await asyncio.to_thread(_scan)
+    _index.clear()
+    for _, key, size in entries:
+        _index[key] = size
+    _loaded = True
+    await _evict()
+
+
+async def lookup(key: str) -> Optional[str]:
+    """Path of the cached audio for `key`, or None. Counts a hit or miss."""
+    if not _loaded:
+        await load_index()
+    size = _index.get(key)
+    if size is None or not os.path.exists(audio_path(key)):
+        _index.pop(key, None)
+        _stats["misses"] += 1
+        return None
+    _index.move_to_end(key)
+    _stats["hits"] += 1
+    _stats["bytes_saved"] += size
+    try:
+        # Keep LRU order across restarts
+        os.utime(audio_path(key))
+    except OSError:
+        pass
+    return audio_path(key)
+
+
+class AudioCacheWriter:
+    """
+    Writes one cache entry incrementally. Nothing is visible until
+    commit(); abort() (or a failed stream) leaves no trace.
+    """
+
+    def __init__(self, key: str):
+        self.key = key
+        self.size = 0
+        self._tmp = os.path.join(TTS_CACHE_DIR, f".{key}.{uuid.uuid4().hex}.tmp")
+        self._file = None
+
+    async def write(self, chunk: bytes):
+        if self._file is None:
+            os.makedirs(TTS_CACHE_DIR, exist_ok=True)
+            self._file = await aiofiles.open(self._tmp, "wb")
+        await self._file.write(chunk)
+        self.size += len(chunk)
+
+    async def commit(self):
+        if self._file is None:
+            return
+        await self._file.close()
+        self._file = None
+        if self.size == 0:
+            os.remove(self._tmp)
+            return
+        path = audio_path(self.key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(self._tmp, path)
+        _index[self.key] = self.size
+        _index.move_to_end(self.key)
+        _stats["writes"] += 1
+        await _evict()
+
+    async def abort(self):
+        if self._file is not None:
+            await self._file.close()
+            self._file = None
+        try:
+            os.remove(self._tmp)
+        except OSError:
+            pass
+
+
+async def store(key: str, data: bytes):
+    """Cache a complete audio file."""
+    writer = AudioCacheWriter(key)
+    try:
+        await writer.write(data)
+        await writer.commit()
+    except Exception:
+        await writer.abort()
+        raise
+
+
+async def _evict():
+    total = sum(_index.values())
+    while total > TTS_CACHE_MAX_BYTES and _index:
+        key, size = _index.popitem(last=False)
+        total -= size
+        _stats["evictions"] += 1
+        try:
+            os.remove(audio_path(key))
+        except OSError:
+            pass
+
+
+def get_audio_cache_stats() -> dict:
+    lookups = _stats["hits"] + _stats["misses"]
+    return {
+        **_stats,
+        "hit_rate": _stats["hits"] / lookups if lookups else 0.0,
+        "entries": len(_index),
+        "bytes": sum(_index.values()),
+        "max_bytes": TTS_CACHE_MAX_BYTES,
+    }
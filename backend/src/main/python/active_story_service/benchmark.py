@@ -0,0 +1,256 @@
+"""
+End-to-end benchmark for the V1 and V2 story flows.
+
+Drives N concurrent simulated families through multi-turn stories against
+a running service, then reports per-endpoint latency percentiles,
+requests/sec, checkpoint bytes per V2 turn and Mongo ops per turn, and
+writes them as JSON so runs can be compared between commits.
+
+Run Mongo from mongo-docker and the service with the stub LLM so results
+are reproducible and free:
+
+    docker compose -f mongo-docker/docker-compose.yml up -d
+    LLM_PROVIDER=stub STUB_LLM_PROFILE=fast uvicorn active_story_service.main:app --port 8000
+
+Then, from backend/src/main/python:
+    python -m active_story_service.benchmark --families 20 --turns 5 --output bench.json
+
+Mongo ops are read per collection from the `top` admin command, counting
+only the collections a story turn touches, so TTL cleanup and other
+databases don't show up. Leave checkpoint compaction off in the service
+(CHECKPOINT_KEEP_LAST=0, the default): its deletes land in the same
+collections. The results record whether it was on.
+"""
+import argparse
+import asyncio
+import json
+import math
+import subprocess
+import time
+import uuid
+from datetime import datetime, timezone
+
+import httpx
+
+from active_story_service import mongo
+from active_story_service.db_crud import (
+    story_collection, checkpoint_collection, checkpoint_writes_collection, summary_collection, segment_collection
+)
+
+V2_TURNS = [
+    "a little owl who is afraid of the dark",
+    "she finds a glowing acorn",
+    "a grumpy badger wants it too",
+    "they decide to share it",
+    "the end",
+]
+V1_IMPROVS = ["a friendly cloud appears", "they build a bridge of leaves", "everyone has a picnic"]
+
+
+class Recorder:
+    """Collects request latencies per endpoint label."""
+
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+
+    async def call(self, label: str, request):
+        started = time.perf_counter()
+        try:
+            response = await request
+            response.raise_for_status()
+            return response
+        except Exception as e:
+            self.errors[label] = self.errors.get(label, 0) + 1
+            print(f"{label} failed: {e}")
+            return None
+        finally:
+            self.latencies.setdefault(label, []).append(time.perf_counter() - started)
+
+    def report(self, elapsed: float) -> dict:
+        endpoints = {}
+        for label, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            endpoints[label] = {
+                "requests": len(values),
+                "errors": self.errors.get(label, 0),
+                "p50_ms": _percentile(values, 0.50),
+                "p95_ms": _percentile(values, 0.95),
+                "p99_ms": _percentile(values, 0.99),
+                "max_ms": round(values[-1] * 1000, 1),
+                "rps": round(len(values) / elapsed, 2),
+            }
+        total = sum(len(v) for v in self.latencies.values())
+        return {"requests": total, "errors": sum(self.errors.values()),
+                "rps": round(total / elapsed, 2), "endpoints": endpoints}
+
+
+def _percentile(values, q: float) -> float:
+    # Nearest-rank percentile
+    index = min(len(values) - 1, max(0, math.ceil(q * len(values)) - 1))
+    return round(values[index] * 1000, 1)
+
+
+async def _read_sse(client: httpx.AsyncClient, url: str, payload: dict) -> httpx.Response:
+    """
+    POST to an SSE endpoint and read the stream to its final event.
+    Raises if the stream ends with an error event (or without a final event).
+    """
+    async with client.stream("POST", url, json=payload) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            event = json.loads(line[len("data:"):])
+            if "error" in event:
+                raise RuntimeError(f"{url} stream failed: {event['error']}")
+            if event.get("done"):
+                return response
+    raise RuntimeError(f"{url} stream ended without a final event")
+
+
+async def v2_family(client: httpx.AsyncClient, recorder: Recorder, turns: int, thread_ids: list):
+    thread_id = f"bench-{uuid.uuid4()}"
+    thread_ids.append(thread_id)
+    for i in range(turns):
+        text = V2_TURNS[i % len(V2_TURNS)]
+        await recorder.call("POST /story/turn", client.post(
+            "/story/turn", json={"thread_id": thread_id, "user_text": text, "theme": V2_TURNS[0]}
+        ))
+    await recorder.call("GET /stories", client.get("/stories", params={"limit": 50}))
+    await recorder.call("GET /story/{thread_id}", client.get(f"/story/{thread_id}"))
+
+
+async def v1_family(client: httpx.AsyncClient, recorder: Recorder, turns: int, story_ids: list):
+    story_id = f"bench-{uuid.uuid4()}"
+    story_ids.append(story_id)
+    await recorder.call("POST /generate-story-stream/", _read_sse(
+        client, "/generate-story-stream/", {"theme": "a brave little snail", "story_id": story_id}
+    ))
+    # V1 stories allow three improvisations
+    for improv in V1_IMPROVS[:max(0, turns - 1)]:
+        await recorder.call("POST /continue-story/", client.post(
+            "/continue-story/", json={"story_id": story_id, "improv": improv}
+        ))
+    await recorder.call("GET /get-all-stories/", client.get("/get-all-stories/"))
+
+
+# Operation kinds reported by `top`, per collection
+TOP_OPS = ("queries", "getmore", "insert", "update", "remove", "commands")
+
+
+async def _opcounters() -> dict:
+    """Operation counts on the collections story turns use, summed by kind."""
+    names = {c().full_name for c in (story_collection, checkpoint_collection, checkpoint_writes_collection,
+                                     summary_collection, segment_collection)}
+    totals = (await mongo.get_client().admin.command("top"))["totals"]
+    counts = dict.fromkeys(TOP_OPS, 0)
+    for name in names:
+        for op in TOP_OPS:
+            counts[op] += totals.get(name, {}).get(op, {}).get("count", 0)
+    return counts
+
+
+async def _compaction_enabled(client: httpx.AsyncClient):
+    try:
+        response = await client.get("/checkpoints/retention-stats")
+        return response.json().get("keep_last", 0) > 0
+    except Exception:
+        return None
+
+
+async def _checkpoint_bytes(thread_ids: list) -> int:
+    total = 0
+    db = mongo.get_checkpoint_db()
+    for name in ("checkpoints", "checkpoint_writes"):
+        async for row in db[name].aggregate([
+            {"$match": {"thread_id": {"$in": thread_ids}}},
+            {"$group": {"_id": None, "bytes": {"$sum": {"$bsonSize": "$$ROOT"}}}},
+        ]):
+            total += row["bytes"]
+    return total
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], text=True).strip()
+    except Exception:
+        return None
+
+
+async def _cleanup(client: httpx.AsyncClient, thread_ids: list, story_ids: list):
+    for thread_id in thread_ids:
+        await client.delete(f"/story/{thread_id}")
+    for story_id in story_ids:
+        await client.delete(f"/delete-story/{story_id}")
+
+
+async def main(args):
+    flows = ["v1", "v2"] if args.flow == "both" else [args.flow]
+    recorder = Recorder()
+    thread_ids, story_ids = [], []
+    limits = httpx.Limits(max_connections=args.families * len(flows) + 10)
+
+    results = None
+    await mongo.connect()
+    try:
+        async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits) as client:
+            compaction = await _compaction_enabled(client)
+            if compaction:
+                print("Warning: checkpoint compaction is on in the service; Mongo ops include its deletes")
+            ops_before = await _opcounters()
+            started = time.perf_counter()
+            families = []
+            for _ in range(args.families):
+                if "v2" in flows:
+                    families.append(v2_family(client, recorder, args.turns, thread_ids))
+                if "v1" in flows:
+                    families.append(v1_family(client, recorder, args.turns, story_ids))
+            await asyncio.gather(*families)
+            elapsed = time.perf_counter() - started
+            ops_after = await _opcounters()
+
+            v2_turns = len(recorder.latencies.get("POST /story/turn", []))
+            v1_turns = (len(recorder.latencies.get("POST /generate-story-stream/", []))
+                        + len(recorder.latencies.get("POST /continue-story/", [])))
+            checkpoint_bytes = await _checkpoint_bytes(thread_ids) if thread_ids else 0
+            ops = {k: ops_after.get(k, 0) - ops_before.get(k, 0) for k in ops_after}
+            story_turns = v1_turns + v2_turns
+
+            results = {
+                "timestamp": datetime.now(timezone.utc).isoformat(),
+                "commit": _git_commit(),
+                "config": {"url": args.url, "flow": args.flow, "families": args.families, "turns": args.turns},
+                "elapsed_seconds": round(elapsed, 3),
+                **recorder.report(elapsed),
+                "story_turns": {"v1": v1_turns, "v2": v2_turns},
+                "checkpoint_bytes_per_turn": round(checkpoint_bytes / v2_turns, 1) if v2_turns else None,
+                "checkpoint_compaction": compaction,
+                "mongo_ops": ops,
+                "mongo_ops_per_turn": round(sum(ops.values()) / story_turns, 2) if story_turns else None,
+            }
+
+            if args.cleanup:
+                await _cleanup(client, thread_ids, story_ids)
+    finally:
+        mongo.close()
+
+    if results is None:
+        return
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--flow", choices=["v1", "v2", "both"], default="both")
+    parser.add_argument("--families", type=int, default=10, help="Concurrent simulated families per flow")
+    parser.add_argument("--turns", type=int, default=5, help="Turns per story (V1 caps at 4)")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--output", help="Write results JSON to this file")
+    parser.add_argument("--cleanup", action="store_true", help="Delete the stories created by the run")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,137 @@
+"""
+Checkpoint retention for the V2 Story System.
+
+LangGraph writes several checkpoints per turn and each one carries the
+whole story state, so storage grows quickly with story length. Only the
+latest checkpoint is needed to continue a story, so a background task can
+periodically keep the newest CHECKPOINT_KEEP_LAST checkpoints per thread
+and drop older checkpoints and writes.
+
+Compaction is opt-in. Only one worker sweeps at a time: it holds the
+"checkpoint_compaction" lease in turn_leases, and the others skip their
+sweeps while it is held. The first sweep a worker makes as leader covers
+every thread; after that only threads whose summary was updated since its
+previous sweep are pruned.
+
+Config:
+- CHECKPOINT_KEEP_LAST: checkpoints kept per thread (default 0: compaction off)
+- CHECKPOINT_COMPACTION_INTERVAL: seconds between sweeps
+"""
+import asyncio
+import os
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Optional
+
+from active_story_service.db_crud import (
+    acquire_turn_lease, release_turn_lease, iter_thread_ids, iter_threads_touched_since,
+    prune_thread_checkpoints
+)
+
+KEEP_LAST = int(os.getenv("CHECKPOINT_KEEP_LAST", "0"))
+COMPACTION_INTERVAL = float(os.getenv("CHECKPOINT_COMPACTION_INTERVAL", "300"))
+
+LEADER_LEASE_ID = "checkpoint_compaction"
+# Outlives one interval, so the leader keeps it between sweeps
+LEADER_LEASE_SECONDS = 2 * COMPACTION_INTERVAL
+_owner = uuid.uuid4().hex
+
+_stats = {
+    "runs": 0,
+    "threads_pruned": 0,
+    "checkpoints_deleted": 0,
+    "writes_deleted": 0,
+    "bytes_reclaimed": 0,
+    "last_run_seconds": None,
+    "last_run_bytes_reclaimed": 0,
+    "last_run_threads_checked": 0,
+    "skipped_not_leader": 0,
+}
+
+_task = None
+
+# Start of this worker's last finished sweep; threads touched since then are swept next
+_swept_until = None
+
+
+async def compact_checkpoints(keep_last: int = KEEP_LAST, since: Optional[datetime] = None) -> dict:
+    """
+    Run one sweep over every thread, or only those touched at or after
+    `since`. Returns what this sweep reclaimed.
+    """
+    started = time.perf_counter()
+    sweep = {"threads_pruned": 0, "checkpoints_deleted": 0, "writes_deleted": 0, "bytes_reclaimed": 0}
+    checked = 0
+
+    threads = iter_threads_touched_since(since) if since is not None else iter_thread_ids()
+    async for thread_id in threads:
+        checked += 1
+        pruned = await prune_thread_checkpoints(thread_id, keep_last)
+        if pruned["checkpoints"] or pruned["writes"]:
+            sweep["threads_pruned"] += 1
+            sweep["checkpoints_deleted"] += pruned["checkpoints"]
+            sweep["writes_deleted"] += pruned["writes"]
+            sweep["bytes_reclaimed"] += pruned["bytes"]
+
+    for key, value in sweep.items():
+        _stats[key] += value
+    _stats["runs"] += 1
+    _stats["last_run_seconds"] = time.perf_counter() - started
+    _stats["last_run_bytes_reclaimed"] = sweep["bytes_reclaimed"]
+    _stats["last_run_threads_checked"] = checked
+    print(f"Checkpoint compaction ({checked} threads checked): {sweep}")
+    return sweep
+
+
+async def _sweep_if_leader():
+    global _swept_until
+    if not await acquire_turn_lease(LEADER_LEASE_ID, _owner, LEADER_LEASE_SECONDS):
+        # Another worker is compacting; if it goes away we start over with a full sweep
+        _swept_until = None
+        _stats["skipped_not_leader"] += 1
+        return
+    sweep_started = datetime.now(timezone.utc)
+    await compact_checkpoints(since=_swept_until)
+    _swept_until = sweep_started
+
+
+async def _compaction_loop():
+    while True:
+        try:
+            await _sweep_if_leader()
+        except Exception as e:
+            print(f"Checkpoint compaction failed: {e}")
+        await asyncio.sleep(COMPACTION_INTERVAL)
+
+
+def start_compaction():
+    """Start the background compaction task. Called on app startup."""
+    global _task
+    if KEEP_LAST > 0 and _task is None:
+        _task = asyncio.create_task(_compaction_loop())
+
+
+async def stop_compaction():
+    """Cancel the background compaction task. Called on app shutdown."""
+    global _task
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
+        try:
+            # Let another worker take over right away
+            await release_turn_lease(LEADER_LEASE_ID, _owner)
+        except Exception as e:
+            print(f"Failed to release compaction lease: {e}")
+
+
+def get_retention_stats() -> dict:
+    stats = dict(_stats)
+    stats["keep_last"] = KEEP_LAST
+    stats["interval_seconds"] = COMPACTION_INTERVAL
+    stats["incremental"] = _swept_until is not None
+    return stats
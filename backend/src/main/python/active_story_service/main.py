@@ -1,19 +1,34 @@
 import uuid
+from contextlib import asynccontextmanager, aclosing
 from typing import Dict, Any, List
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from active_story_service.db_crud import (
-    add_story, get_single_story, get_all_stories, update_story, delete_story
+    add_story, get_single_story, get_all_stories, delete_story,
+    append_story_continuation, get_story_context, story_content, ensure_indexes, verify_indexes
 )
 from active_story_service.models import StoryInput, ContinueStoryInput
 from active_story_service.routes_v2 import router as v2_router
-import os
-
-import anthropic
-from anthropic import HUMAN_PROMPT, AI_PROMPT
-
-from anthropic import AsyncAnthropic
+from active_story_service.app.llm import (
+    get_http_client, close_http_client, get_http_client_stats, CACHE_CONTROL, HAIKU
+)
+from active_story_service.app.providers import llm_messages, llm_messages_stream, get_hedge_stats
+from active_story_service.app.admission import LLMOverloadedError, get_admission_stats
+from active_story_service.app.deadlines import LLMTimeoutError
+from active_story_service.app.extraction import drain_pending_extractions, get_extraction_stats
+from active_story_service.checkpoint_retention import start_compaction, stop_compaction, get_retention_stats
+from active_story_service.app.world_cache import get_world_cache_stats
+from active_story_service.app.turn_coordinator import get_turn_stats
+from active_story_service import audio_cache, tts
+from active_story_service.narration import narrate, TagFilter
+from active_story_service.response_cache import (
+    get_cached_turn, store_turn, forget_thread, get_response_cache_stats
+)
+from active_story_service.metrics import register_stats, render_metrics
+from active_story_service import mongo
+import time
 
 import re
 
@@ -24,55 +39,21 @@ from pathlib import Path
 env_path = Path(__file__).parent.parent.parent.parent.parent.parent / '.env'
 load_dotenv(dotenv_path=env_path)
 
-client = AsyncAnthropic(
-    api_key=os.environ["ANTHROPIC_API_KEY"],
-)
-
-
-
-app = FastAPI()
+# V1 and V2 share the provider layer (LLM_PROVIDER); the stub needs no API key
+V1_MODEL = HAIKU
 
 
-# Enable CORS
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["http://localhost:3000"],  # Allow only the React frontend
-    allow_credentials=True,
-    allow_methods=["*"],  # Allow all methods (GET, POST, etc.)
-    allow_headers=["*"],  # Allow all headers
-)
-
 # ============================================================================
-# V2 Agentic Story Endpoints (LangGraph-based) - See routes_v2.py
-# ============================================================================
-# Include V2 router with backward-compatible paths
-app.include_router(v2_router, prefix="", tags=["V2 Stories"])
-
-# Backward compatibility aliases for frontend
-from active_story_service.routes_v2 import get_all_v2_stories, get_v2_story, delete_v2_story
-app.get("/stories-v2/")(get_all_v2_stories)
-app.get("/story-v2/{thread_id}")(get_v2_story)
-app.delete("/story-v2/{thread_id}")(delete_v2_story)
-
-# ============================================================================
-# V1 Story Endpoints (Original)
+# V1 Prompts
 # ============================================================================
+# The static instructions come first and end with a cache breakpoint, so the
+# provider can serve them from its prompt cache; per-story data follows.
 
-@app.post("/generate-story/")
-async def generate_story(input_data: StoryInput):
-    #story_content = f"Once upon a time, in a land where {input_data.theme}, there lived a..."
+GENERATE_STORY_SYSTEM = "You are a creative storyteller whose goal is to make story generation a delightful bonding experience for parents and children. Always finish your thoughts, and avoid starting with 'Once upon a time."
 
-    theme = input_data.theme
-    #characters = input_data.characters if hasattr(input_data, 'characters') else "some interesting characters"
-    #location = input_data.location if hasattr(input_data, 'location') else "a magical place"
+GENERATE_STORY_INSTRUCTIONS = """You are a creative storyteller for young children. Your task is to begin a short, engaging story based on a given theme. This story should be suitable for children aged 3-6 and will encourage co-creation between parents and children.
 
-    
-    prompt = f"""You are a creative storyteller for young children. Your task is to begin a short, engaging story based on a given theme. This story should be suitable for children aged 3-6 and will encourage co-creation between parents and children.
-
-    Here is the theme for the story:
-    <theme>
-    {theme}
-    </theme>
+    The theme for the story is given inside <theme> tags at the end of this message.
 
     Before writing the story, plan your approach inside <story_planning> tags, considering the following:
 
@@ -108,35 +89,199 @@ async def generate_story(input_data: StoryInput):
 
     Start your response with your story planning, followed by the story fragment."""
 
+CONTINUE_STORY_SYSTEM = "Your goal is to continue the story from where it stopped, smoothly incorporating the user input while adhering to the current theme. Keep the continuation short and simple about 20-20 words"
 
-    message = await client.messages.create(
-        model="claude-3-haiku-20240307",
-        max_tokens=1000,
-        temperature=0.8,
-        system="You are a creative storyteller whose goal is to make story generation a delightful bonding experience for parents and children. Always finish your thoughts, and avoid starting with 'Once upon a time.",
-        messages=[
-            {
-                "role": "user",
-                "content": [
-                    {
-                        "type": "text",
-                        "text": prompt
-                    }
-                ]
-            },
-            {
-                "role": "assistant",
-                "content": [
-                    {
-                        "type": "text",
-                        "text": "<story_planning>"
-                    }
-                ]
-            }
-        ]
+CONTINUE_STORY_INSTRUCTIONS = """You are an AI storyteller specializing in continuing stories for young children (ages 3-6). Your task is to generate engaging story continuations (about 20 words) that incorporate user input while maintaining the story's theme and flow. You will be working with the following elements, given at the end of this message:
+
+    1. The current story, inside <current_story> tags.
+    2. The current theme of the story, inside <current_theme> tags.
+    3. User input to incorporate, inside <user_input> tags.
+    4. Remaining improvisations, inside <remaining_improvs> tags.
+
+    Your goal is to continue the story from where it stopped, smoothly incorporating the user input while adhering to the current theme. Follow these steps:
+
+    1. Analyze the current story and theme.
+    2. Plan how to incorporate the user input naturally.
+    3. Generate a continuation that flows seamlessly from the existing story.
+    4. Ensure the continuation doesn't repeat any part of the existing content.
+    5. Check if more user input is needed based on the remaining_improvs value.
+
+    Before writing the continuation, plan your approach inside <story_planning> tags. Include the following:
+    - A 1-2 sentence summary of the current story and theme.
+    - 2-3 key elements from the user input to incorporate.
+    - 2-3 ways to naturally include the user input in the story.
+    - 1-2 potential plot developments or character arcs.
+    - 2-3 age-appropriate language choices or concepts to include.
+    - The current value of remaining_improvs and how it affects your plan.
+    - 2-3 potential challenges in incorporating the user input and how to overcome them.
+    - A brief list of 5-7 age-appropriate vocabulary words related to the story theme and user input.
+    - 1-2 ideas for simple moral lessons or positive messages that could be subtly included.
+
+    After your planning process, write the story continuation inside <story_continuation> tags. The continuation should:
+    - Be engaging and suitable for children aged 3-6.
+    - Use simple, age-appropriate language.
+    - Flow naturally from the existing story.
+    - Incorporate the user input seamlessly.
+    - Maintain the current theme.
+    - Avoid repeating any part of the existing content.
+    - Include at least 3 of the age-appropriate vocabulary words you listed.
+    - Subtly incorporate one of the moral lessons or positive messages you identified.
+
+    If remaining_improvs is greater than 0, end your continuation at a point that naturally invites further user input. If remaining_improvs is 0 or less, bring the story to a satisfying conclusion.
+
+    Remember, your role is to continue an existing story, not to start a new one. Focus on creating a smooth, engaging continuation that feels like a natural progression of the narrative.
+
+    Example output structure:
+
+    <story_planning>
+    [Your detailed analysis and planning for the story continuation]
+    </story_planning>
+
+    <story_continuation>
+    [Your age-appropriate story continuation, incorporating user input and adhering to the theme]
+    </story_continuation>"""
+
+
+# Like V2's format_state_for_prompt, continuations only see the end of the story
+V1_CONTEXT_SEGMENTS = 3
+V1_CONTEXT_CHARS = 1000
+
+
+# The cache breakpoints below mark the static instructions, but each prefix is
+# well under Haiku's 2048-token minimum, so V1_MODEL doesn't cache them today.
+# They take effect if the instructions grow or V1 moves to a model with a
+# lower minimum (1024 tokens for Sonnet).
+def generate_story_messages(theme: str) -> List[Dict[str, Any]]:
+    """Messages for starting a V1 story: cached instructions, then the theme."""
+    return [
+        {
+            "role": "user",
+            "content": [
+                {"type": "text", "text": GENERATE_STORY_INSTRUCTIONS, "cache_control": CACHE_CONTROL},
+                {"type": "text", "text": f"""<theme>
+    {theme}
+    </theme>"""}
+            ]
+        },
+        {
+            "role": "assistant",
+            "content": [{"type": "text", "text": "<story_planning>"}]
+        }
+    ]
+
+
+def continue_story_messages(current_story: str, current_theme: str, improv: str, remaining_improvs: int) -> List[Dict[str, Any]]:
+    """Messages for continuing a V1 story: cached instructions, then the story data."""
+    return [
+        {
+            "role": "user",
+            "content": [
+                {"type": "text", "text": CONTINUE_STORY_INSTRUCTIONS, "cache_control": CACHE_CONTROL},
+                {"type": "text", "text": f"""<current_story>
+    {current_story}
+    </current_story>
+
+    <current_theme>
+    {current_theme}
+    </current_theme>
+
+    <user_input>
+    {improv}
+    </user_input>
+
+    <remaining_improvs>
+    {remaining_improvs}
+    </remaining_improvs>
+
+    Please proceed with your story planning and continuation based on the provided information."""}
+            ]
+        },
+        {
+            "role": "assistant",
+            "content": [{"type": "text", "text": "<story_planning>"}]
+        }
+    ]
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Open the pooled LLM client up front so the first turn doesn't pay for it
+    get_http_client()
+    try:
+        await mongo.connect()
+        await ensure_indexes()
+    except Exception as e:
+        print(f"MongoDB startup failed: {e}")
+    try:
+        await audio_cache.load_index()
+    except Exception as e:
+        print(f"TTS audio cache startup failed: {e}")
+    start_compaction()
+    yield
+    await stop_compaction()
+    # Let background extractions commit before the LLM client and Mongo pool go away
+    await drain_pending_extractions()
+    await close_http_client()
+    await tts.close_tts_client()
+    mongo.close()
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+@app.exception_handler(LLMOverloadedError)
+async def llm_overloaded_handler(request: Request, exc: LLMOverloadedError):
+    """Shed LLM calls become a 503 the client can retry, not a 500."""
+    return JSONResponse(
+        status_code=503,
+        content={"detail": f"Story service is busy, please retry: {exc}"},
+        headers={"Retry-After": str(max(1, round(exc.retry_after)))},
     )
 
-    response = message.content[0].text
+
+# Enable CORS
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["http://localhost:3000"],  # Allow only the React frontend
+    allow_credentials=True,
+    allow_methods=["*"],  # Allow all methods (GET, POST, etc.)
+    allow_headers=["*"],  # Allow all headers
+    expose_headers=["X-Next-Cursor", "Content-Location"],  # Paged /stories listings, TTS audio URLs
+)
+
+# ============================================================================
+# V2 Agentic Story Endpoints (LangGraph-based) - See routes_v2.py
+# ============================================================================
+# Include V2 router with backward-compatible paths
+app.include_router(v2_router, prefix="", tags=["V2 Stories"])
+
+# Backward compatibility aliases for frontend
+from active_story_service.routes_v2 import get_all_v2_stories, get_v2_story, delete_v2_story
+app.get("/stories-v2/")(get_all_v2_stories)
+app.get("/story-v2/{thread_id}")(get_v2_story)
+app.delete("/story-v2/{thread_id}")(delete_v2_story)
+
+# ============================================================================
+# V1 Story Endpoints (Original)
+# ============================================================================
+
+@app.post("/generate-story/")
+async def generate_story(input_data: StoryInput):
+    #story_content = f"Once upon a time, in a land where {input_data.theme}, there lived a..."
+
+    theme = input_data.theme
+    #characters = input_data.characters if hasattr(input_data, 'characters') else "some interesting characters"
+    #location = input_data.location if hasattr(input_data, 'location') else "a magical place"
+
+    
+    response = await llm_messages(
+        GENERATE_STORY_SYSTEM,
+        generate_story_messages(theme),
+        max_tokens=1000,
+        model=V1_MODEL,
+        node="v1_generate_story",
+        temperature=0.8
+    )
     story_match = re.search(r'<story>(.*?)</story>', response, re.DOTALL)
     if story_match:
         initial_content = story_match.group(1).strip()  # Get the matched content and strip leading/trailing whitespace
@@ -146,8 +291,7 @@ async def generate_story(input_data: StoryInput):
     story_data = {
         "story_id": input_data.story_id,  # Use frontend-provided ID
         "theme": theme,
-        "content": initial_content,
-        "story_cursor": len(initial_content),
+        "segments": [initial_content],
         "improvisations": input_data.improvisations,
         "remaining_improvs": 3,  # You may want to track this dynamically based on usage
         "waiting_for_input": waiting_for_input  # New flag to indicate waiting for input
@@ -175,92 +319,118 @@ async def generate_story_stream(input_data: StoryInput):
     theme = input_data.theme
     story_id = input_data.story_id if hasattr(input_data, 'story_id') else None
 
-    prompt = f"""You are a creative storyteller for young children. Your task is to begin a short, engaging story based on a given theme. This story should be suitable for children aged 3-6 and will encourage co-creation between parents and children.
-
-    Here is the theme for the story:
-    <theme>
-    {theme}
-    </theme>
-
-    Before writing the story, plan your approach inside <story_planning> tags, considering the following:
-
-    1. **Character Development**:
-    - Create non-traditional characters that challenge stereotypes.
-    - Describe their unique traits and abilities in a fun way.
-
-    2. **Setting Creation**:
-    - Imagine an interesting and imaginative setting that sparks curiosity.
-    - Think about how the setting can enhance the story's magic.
+    async def event_generator():
+        full_response = ""
+        try:
+            async for text in llm_messages_stream(
+                GENERATE_STORY_SYSTEM,
+                generate_story_messages(theme),
+                max_tokens=1000,
+                model=V1_MODEL,
+                node="v1_generate_story_stream",
+                temperature=0.8
+            ):
+                full_response += text
+                # Don't stream to frontend - let frontend show only after audio is ready
 
-    3. **Plot Outline**:
-    - Develop a simple yet engaging plot idea.
-    - Introduce a gentle conflict or challenge for the characters to overcome.
+            # Extract story from response
+            story_match = re.search(r'<story>(.*?)</story>', full_response, re.DOTALL)
+            initial_content = ""
+            if story_match:
+                initial_content = story_match.group(1).strip()
+
+            waiting_for_input = "..." in initial_content
+
+            # Save to database
+            story_data = {
+                "story_id": input_data.story_id,  # Use frontend-provided ID
+                "theme": theme,
+                "segments": [initial_content],
+                "improvisations": input_data.improvisations,
+                "remaining_improvs": 3,
+                "waiting_for_input": waiting_for_input
+            }
 
-    4. **Opportunities for Child Participation**:
-    - Plan moments for children to contribute their ideas and imagination.
-    - Include open-ended questions to encourage creativity during the story.
+            saved_story_id = await add_story(story_data)
+
+            # Send final message with story_id
+            yield f"data: {json.dumps({'done': True, 'story': initial_content, 'story_id': saved_story_id, 'waiting_for_input': waiting_for_input})}\n\n"
+        except LLMOverloadedError as e:
+            # Headers are already sent, so the 503 goes out as an SSE error event
+            print(f"V1 story stream shed: {e}")
+            yield f"data: {json.dumps({'error': f'Story service is busy, please retry: {e}', 'retry_after': e.retry_after})}\n\n"
+        except LLMTimeoutError as e:
+            print(f"V1 story stream timed out: {e}")
+            yield f"data: {json.dumps({'error': f'Story generation timed out, please retry: {e}', 'retry_after': 1})}\n\n"
+        except Exception as e:
+            print(f"V1 story stream error: {e}")
+            import traceback
+            traceback.print_exc()
+            yield f"data: {json.dumps({'error': f'Story generation failed: {str(e)}'})}\n\n"
 
-    5. **Educational Elements**:
-    - Consider moral lessons or educational themes to subtly weave into the narrative.
-    - Ensure these lessons are presented in a fun and engaging manner.
+    return StreamingResponse(event_generator(), media_type="text/event-stream")
 
-    After your planning, write the beginning of the story (about 20 words) inside <story> tags. Remember to stop mid-story, leaving space for the child to continue co-creating.
 
-    Your story should:
-    1. Be engaging and kid-friendly.
-    2. Use simple language suitable for 3-6 year olds.
-    3. Introduce characters with non-traditional roles that promote diversity.
-    4. Avoid gender stereotypes.
-    5. Encourage imagination and creativity.
-    6. Be open-ended to allow for co-creation.
+@app.post("/generate-story-narrated/")
+async def generate_story_narrated(input_data: StoryInput):
+    """
+    Generate a story with narration pipelined into the LLM stream.
+    Each sentence is sent to TTS as soon as Claude finishes writing it;
+    SSE events carry the sentence text and then its base64 audio, in
+    story order (see narration.py), followed by the usual `done` event.
+    """
+    from fastapi.responses import StreamingResponse
+    import json
 
-    Start your response with your story planning, followed by the story fragment."""
+    theme = input_data.theme
 
     async def event_generator():
         full_response = ""
+        story_tag = TagFilter("story")
+
+        async def story_text():
+            nonlocal full_response
+            async with aclosing(llm_messages_stream(
+                GENERATE_STORY_SYSTEM,
+                generate_story_messages(theme),
+                max_tokens=1000,
+                model=V1_MODEL,
+                node="v1_generate_story_narrated",
+                temperature=0.8
+            )) as stream:
+                async for text in stream:
+                    full_response += text
+                    # Only the text inside <story> is narrated
+                    yield story_tag.feed(text)
+            yield story_tag.flush()
+
+        try:
+            # aclosing: a client disconnect closes narrate(), which cancels its TTS calls
+            async with aclosing(narrate(story_text())) as events:
+                async for event in events:
+                    yield f"data: {json.dumps(event)}\n\n"
+        except LLMOverloadedError as e:
+            print(f"Narrated story shed: {e}")
+            yield f"data: {json.dumps({'error': f'Story service is busy, please retry: {e}', 'retry_after': e.retry_after})}\n\n"
+            return
+        except Exception as e:
+            print(f"Narrated story error: {e}")
+            yield f"data: {json.dumps({'error': f'Story generation failed: {str(e)}'})}\n\n"
+            return
 
-        async with client.messages.stream(
-            model="claude-3-haiku-20240307",
-            max_tokens=1000,
-            temperature=0.8,
-            system="You are a creative storyteller whose goal is to make story generation a delightful bonding experience for parents and children. Always finish your thoughts, and avoid starting with 'Once upon a time.",
-            messages=[
-                {
-                    "role": "user",
-                    "content": [{"type": "text", "text": prompt}]
-                },
-                {
-                    "role": "assistant",
-                    "content": [{"type": "text", "text": "<story_planning>"}]
-                }
-            ]
-        ) as stream:
-            async for text in stream.text_stream:
-                full_response += text
-                # Don't stream to frontend - let frontend show only after audio is ready
-
-        # Extract story from response
         story_match = re.search(r'<story>(.*?)</story>', full_response, re.DOTALL)
-        initial_content = ""
-        if story_match:
-            initial_content = story_match.group(1).strip()
-
+        initial_content = story_match.group(1).strip() if story_match else ""
         waiting_for_input = "..." in initial_content
 
-        # Save to database
-        story_data = {
+        saved_story_id = await add_story({
             "story_id": input_data.story_id,  # Use frontend-provided ID
             "theme": theme,
-            "content": initial_content,
-            "story_cursor": len(initial_content),
+            "segments": [initial_content],
             "improvisations": input_data.improvisations,
             "remaining_improvs": 3,
             "waiting_for_input": waiting_for_input
-        }
+        })
 
-        saved_story_id = await add_story(story_data)
-
-        # Send final message with story_id
         yield f"data: {json.dumps({'done': True, 'story': initial_content, 'story_id': saved_story_id, 'waiting_for_input': waiting_for_input})}\n\n"
 
     return StreamingResponse(event_generator(), media_type="text/event-stream")
@@ -271,7 +441,14 @@ async def continue_story(input_data: ContinueStoryInput):
     story_id = input_data.story_id
     improv = input_data.improv
 
-    story = await get_single_story(story_id)
+    # A retry of a continuation that already finished gets the same response
+    cached = get_cached_turn("continue_story", story_id, improv, input_data.turn)
+    if cached is not None:
+        print(f"Continuation served from response cache: story_id={story_id}")
+        return cached
+
+    # Only the last few segments are read; the prompt gets a bounded window
+    story = await get_story_context(story_id, V1_CONTEXT_SEGMENTS)
 
     if not story:
         raise HTTPException(status_code=404, detail="Story not found")
@@ -281,105 +458,19 @@ async def continue_story(input_data: ContinueStoryInput):
         return {"message": "The story is finished, no more improvisations allowed."}
     
     current_theme = story["theme"]
-    current_story = story["content"]
-    story_cursor = story.get("story_cursor", len(current_story))  # Default to end if no cursor
+    current_story = story_content(story)
+    if len(current_story) > V1_CONTEXT_CHARS:
+        current_story = "..." + current_story[-V1_CONTEXT_CHARS:]
 
-    print("context", current_story[story_cursor:])
     # Refined continuation prompt
 
-    prompt = f"""You are an AI storyteller specializing in continuing stories for young children (ages 3-6). Your task is to generate engaging story continuations (about 20 words) that incorporate user input while maintaining the story's theme and flow. You will be working with the following elements:
-
-    1. The current story:
-    <current_story>
-    {current_story}
-    </current_story>
-
-    2. The current theme of the story:
-    <current_theme>
-    {current_theme}
-    </current_theme>
-
-    3. User input to incorporate:
-    <user_input>
-    {improv}
-    </user_input>
-
-    4. Remaining improvisations:
-    <remaining_improvs>
-    {story['remaining_improvs']}
-    </remaining_improvs>
-
-    Your goal is to continue the story from where it stopped, smoothly incorporating the user input while adhering to the current theme. Follow these steps:
-
-    1. Analyze the current story and theme.
-    2. Plan how to incorporate the user input naturally.
-    3. Generate a continuation that flows seamlessly from the existing story.
-    4. Ensure the continuation doesn't repeat any part of the existing content.
-    5. Check if more user input is needed based on the remaining_improvs value.
-
-    Before writing the continuation, plan your approach inside <story_planning> tags. Include the following:
-    - A 1-2 sentence summary of the current story and theme.
-    - 2-3 key elements from the user input to incorporate.
-    - 2-3 ways to naturally include the user input in the story.
-    - 1-2 potential plot developments or character arcs.
-    - 2-3 age-appropriate language choices or concepts to include.
-    - The current value of remaining_improvs and how it affects your plan.
-    - 2-3 potential challenges in incorporating the user input and how to overcome them.
-    - A brief list of 5-7 age-appropriate vocabulary words related to the story theme and user input.
-    - 1-2 ideas for simple moral lessons or positive messages that could be subtly included.
-
-    After your planning process, write the story continuation inside <story_continuation> tags. The continuation should:
-    - Be engaging and suitable for children aged 3-6.
-    - Use simple, age-appropriate language.
-    - Flow naturally from the existing story.
-    - Incorporate the user input seamlessly.
-    - Maintain the current theme.
-    - Avoid repeating any part of the existing content.
-    - Include at least 3 of the age-appropriate vocabulary words you listed.
-    - Subtly incorporate one of the moral lessons or positive messages you identified.
-
-    If remaining_improvs is greater than 0, end your continuation at a point that naturally invites further user input. If remaining_improvs is 0 or less, bring the story to a satisfying conclusion.
-
-    Remember, your role is to continue an existing story, not to start a new one. Focus on creating a smooth, engaging continuation that feels like a natural progression of the narrative.
-
-    Example output structure:
-
-    <story_planning>
-    [Your detailed analysis and planning for the story continuation]
-    </story_planning>
-
-    <story_continuation>
-    [Your age-appropriate story continuation, incorporating user input and adhering to the theme]
-    </story_continuation>
-
-    Please proceed with your story planning and continuation based on the provided information."""
-
-    message = await client.messages.create(
-        model="claude-3-haiku-20240307",
+    response = await llm_messages(
+        CONTINUE_STORY_SYSTEM,
+        continue_story_messages(current_story, current_theme, improv, story['remaining_improvs']),
         max_tokens=1000,
-        system="Your goal is to continue the story from where it stopped, smoothly incorporating the user input while adhering to the current theme. Keep the continuation short and simple about 20-20 words",  
-        messages=[
-            {
-                "role": "user", 
-                "content": [ 
-                {
-                    "type": "text",
-                    "text": prompt
-                } 
-            ]
-            },
-            {
-                "role": "assistant",
-                "content": [
-                {
-                    "type": "text",
-                    "text": "<story_planning>"
-                }
-            ]
-            }
-        ]
+        model=V1_MODEL,
+        node="v1_continue_story"
     )
-    response = message.content[0].text
 
     new_content = None
 
@@ -389,21 +480,14 @@ async def continue_story(input_data: ContinueStoryInput):
         new_content = story_match.group(1).strip()  # Get the matched content and strip leading/trailing whitespace
     
 
-    continued_story = f"{story['content']} \n\n\n {new_content}"  # Append the new part only
-    new_cursor = len(continued_story)
-
-    story['improvisations'].append(improv)
-    update_data = {
-        "content": continued_story, 
-        "story_cursor": new_cursor,
-        "improvisations": story['improvisations'],
-        "remaining_improvs": story['remaining_improvs'] - 1
-    }
-    await update_story(story_id, update_data)
-
-    story = await get_single_story(story_id)
+    # Append the new part only, atomically; returns the updated story
+    story = await append_story_continuation(story_id, improv, new_content or "")
+    if not story:
+        return {"message": "The story is finished, no more improvisations allowed."}
 
-    return {"story_id": story["story_id"], "story": story["content"]}
+    result = {"story_id": story["story_id"], "story": story_content(story)}
+    store_turn("continue_story", story_id, improv, len(story.get("improvisations", [])), result)
+    return result
 
 
 @app.get("/get-story/")
@@ -416,7 +500,7 @@ async def get_story(story_id: str):
 
     return {
         "story_id": story_id,
-        "content": story.get("content", ""),
+        "content": story_content(story),
         "theme": story.get("theme", ""),
         "improvisations": story.get("improvisations", []),
         "remaining_improvs": story.get("remaining_improvs", 0)
@@ -434,19 +518,29 @@ async def get_all_stories_endpoint() -> List[Dict[str, Any]]:
 @app.delete("/delete-story/{story_id}")
 async def delete_story_endpoint(story_id: str):
     success = await delete_story(story_id)
+    forget_thread("continue_story", story_id)
     if not success:
         raise HTTPException(status_code=404, detail="Story not found")
     return {"message": "Story deleted successfully"}
 
 
+# Audio is addressed by content, so clients may cache it forever
+TTS_CACHE_HEADERS = {
+    "Content-Disposition": "inline",
+    "Cache-Control": "public, max-age=31536000, immutable",
+}
+
+
 @app.post("/text-to-speech/")
 async def text_to_speech(request: Dict[str, Any]):
     """
     Convert text to speech using Deepgram API with aura-2-thalia-en model.
-    Simple and fast - just returns audio without extra metadata.
+    Audio is cached on disk by hash of model + text and served from disk
+    on replays; uncached audio is streamed through as Deepgram produces it.
+    Content-Location names the cacheable GET /text-to-speech/{key} URL for
+    the same audio.
     """
-    from fastapi.responses import Response
-    import httpx
+    from fastapi.responses import FileResponse, StreamingResponse
 
     text = request.get("text", "")
 
@@ -459,29 +553,22 @@ async def text_to_speech(request: Dict[str, Any]):
     if not text:
         raise HTTPException(status_code=400, detail="Text is required")
 
-    try:
-        # Use Deepgram Aura 2 - Thalia voice (expressive storytelling)
-        url = "https://api.deepgram.com/v1/speak?model=aura-2-thalia-en"
+    key = audio_cache.audio_key(tts.TTS_MODEL, text)
+    headers = {
+        "Content-Disposition": "inline",
+        "ETag": f'"{key}"',
+        "Content-Location": f"/text-to-speech/{key}",
+    }
 
-        headers = {
-            "Authorization": f"Token {os.environ.get('DEEPGRAM_API_KEY')}",
-            "Content-Type": "text/plain"  # Send as plain text, not JSON
-        }
+    cached_path = await audio_cache.lookup(key)
+    if cached_path:
+        return FileResponse(cached_path, media_type="audio/mp3", headers=headers)
 
-        # Make async HTTP request to Deepgram
-        async with httpx.AsyncClient() as client:
-            response = await client.post(url, headers=headers, content=text, timeout=30.0)
-            response.raise_for_status()
-            audio_data = response.content
-
-        # Return audio as response
-        return Response(
-            content=audio_data,
-            media_type="audio/mp3",
-            headers={
-                "Content-Disposition": "inline",
-                "Cache-Control": "no-cache"
-            }
+    try:
+        started = time.perf_counter()
+        response = await tts.open_speech(text)
+        return StreamingResponse(
+            tts.relay_speech(response, key, started), media_type="audio/mp3", headers=headers
         )
 
     except Exception as e:
@@ -491,6 +578,67 @@ async def text_to_speech(request: Dict[str, Any]):
         raise HTTPException(status_code=500, detail=f"TTS failed: {str(e)}")
 
 
+@app.get("/text-to-speech/{key}")
+async def get_speech(key: str, http_request: Request):
+    """
+    Cached audio by content key (from a POST's Content-Location). The key
+    is the ETag; the same key always means the same audio, so a matching
+    If-None-Match gets 304 Not Modified.
+    """
+    from fastapi.responses import FileResponse, Response
+
+    if not re.fullmatch(r"[0-9a-f]{64}", key):
+        raise HTTPException(status_code=404, detail="Audio not found")
+
+    etag = f'"{key}"'
+    headers = {**TTS_CACHE_HEADERS, "ETag": etag}
+    if etag in http_request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+
+    cached_path = await audio_cache.lookup(key)
+    if not cached_path:
+        # Evicted (or never synthesized): POST the text again
+        raise HTTPException(status_code=404, detail="Audio not found")
+    return FileResponse(cached_path, media_type="audio/mp3", headers=headers)
+
+
+register_stats("story_llm_pool", "Shared LLM HTTP client connection reuse", get_http_client_stats)
+register_stats("story_world_cache", "Speculative world cache", get_world_cache_stats)
+register_stats("story_checkpoint_retention", "Checkpoint compaction", get_retention_stats)
+register_stats("story_mongo_pool", "Shared Mongo connection pool", mongo.get_pool_stats)
+register_stats("story_llm_admission", "LLM admission control (queue depth, in flight, shed)", get_admission_stats)
+register_stats("story_llm_hedge", "Hedged storyteller calls", get_hedge_stats)
+register_stats("story_tts_cache", "Content-addressed TTS audio cache", audio_cache.get_audio_cache_stats)
+register_stats("story_response_cache", "Replayed responses for retried story turns", get_response_cache_stats)
+register_stats("story_turn_coordinator", "Per-thread turn serialization and idempotent replays", get_turn_stats)
+register_stats("story_deferred_extraction", "Deferred extractions (completed, retried, failed, pending)", get_extraction_stats)
+
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus-style metrics: per-node, LLM and checkpoint latency histograms, tokens and cache/pool stats."""
+    from fastapi.responses import PlainTextResponse
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/indexes")
+async def index_report():
+    """Missing, unmanaged and unused Mongo indexes."""
+    return await verify_indexes()
+
+
+@app.get("/llm/pool-stats")
+async def llm_pool_stats():
+    """How many LLM requests reused a pooled connection vs. opened a new one."""
+    return get_http_client_stats()
+
+
+@app.get("/checkpoints/retention-stats")
+async def checkpoint_retention_stats():
+    """Checkpoint compaction counters, including bytes reclaimed."""
+    return get_retention_stats()
+
+
 @app.get("/")
 async def root():
     return {"message": "Welcome to the Bedtime Reading App"}
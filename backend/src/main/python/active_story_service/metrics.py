@@ -0,0 +1,225 @@
+"""
+In-process metrics for the story service, exposed in Prometheus text format
+at /metrics.
+
+- Histogram / Counter: labelled series, rendered by render_metrics()
+- timed(): times a block into a histogram and records it as a span of the
+  current turn
+- turn_trace(): collects a turn's spans and prints one log line keyed by
+  thread_id when the turn ends
+- register_stats(): exports an existing stats dict (pool, caches, ...) as gauges
+"""
+import json
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_metrics: List["_Metric"] = []
+_stats_sources: List[Tuple[str, str, Callable[[], dict]]] = []
+
+# Spans of the turn being handled, and the innermost open span
+_turn: ContextVar[Optional[dict]] = ContextVar("story_turn", default=None)
+_span: ContextVar[Optional[dict]] = ContextVar("story_span", default=None)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    inner = ",".join(f'{k}="{_escape(v)}"' for k, v in labels)
+    return "{" + inner + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        _metrics.append(self)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Monotonic counter with labels."""
+    type = "counter"
+
+    def __init__(self, name: str, help: str):
+        super().__init__(name, help)
+        self._values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self) -> List[str]:
+        return [f"{self.name}{_format_labels(k)} {_format_value(v)}" for k, v in self._values.items()]
+
+
+class Histogram(_Metric):
+    """Cumulative-bucket histogram with labels."""
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._series: Dict[tuple, dict] = {}
+        # Some observations come from driver threads (e.g. Mongo pool events)
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["counts"][i] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def count(self, **labels) -> int:
+        series = self._series.get(tuple(sorted(labels.items())))
+        return series["count"] if series else 0
+
+    def quantile(self, q: float, **labels) -> Optional[float]:
+        """Approximate quantile: upper bound of the bucket holding it."""
+        series = self._series.get(tuple(sorted(labels.items())))
+        if not series or not series["count"]:
+            return None
+        rank = q * series["count"]
+        for bound, count in zip(self.buckets, series["counts"]):
+            if count >= rank:
+                return bound
+        return None
+
+    def _samples(self) -> List[str]:
+        lines = []
+        for key, series in self._series.items():
+            for bound, count in zip(self.buckets, series["counts"]):
+                labels = key + (("le", _format_value(bound)),)
+                lines.append(f"{self.name}_bucket{_format_labels(labels)} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(series['sum'])}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {series['count']}")
+        return lines
+
+
+def register_stats(prefix: str, help: str, source: Callable[[], dict]):
+    """Export the numeric values of a stats dict as `{prefix}_{key}` gauges."""
+    _stats_sources.append((prefix, help, source))
+
+
+def _render_stats() -> List[str]:
+    lines = []
+    for prefix, help, source in _stats_sources:
+        try:
+            stats = source()
+        except Exception as e:
+            print(f"Failed to collect {prefix} stats: {e}")
+            continue
+        for key, value in stats.items():
+            if isinstance(value, bool):
+                value = int(value)
+            if not isinstance(value, (int, float)):
+                continue
+            name = f"{prefix}_{key}"
+            lines.extend([f"# HELP {name} {help}", f"# TYPE {name} gauge", f"{name} {_format_value(value)}"])
+    return lines
+
+
+def render_metrics() -> str:
+    """All metrics in Prometheus text exposition format."""
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    lines.extend(_render_stats())
+    return "\n".join(lines) + "\n"
+
+
+# ============================================================================
+# Story metrics
+# ============================================================================
+
+turn_seconds = Histogram("story_turn_seconds", "Full story turn latency by endpoint")
+node_seconds = Histogram("story_node_seconds", "Graph node latency")
+llm_call_seconds = Histogram("story_llm_call_seconds", "LLM call latency by calling node")
+checkpoint_seconds = Histogram("story_checkpoint_seconds", "Checkpoint load/save latency")
+stream_ttft_seconds = Histogram("story_stream_ttft_seconds", "Time to first streamed story token")
+llm_first_token_seconds = Histogram("story_llm_first_token_seconds", "Time to first streamed LLM token by node")
+llm_queue_wait_seconds = Histogram("story_llm_queue_wait_seconds", "Time LLM calls wait for admission, by model")
+tts_first_byte_seconds = Histogram("story_tts_first_byte_seconds", "Time from TTS request to first audio byte relayed")
+llm_timeouts = Counter("story_llm_timeouts_total", "LLM calls that ran out of their deadline, by node")
+llm_json_parse = Counter("story_llm_json_parse_total", "LLM JSON replies by node and outcome (ok, repaired, invalid, early)")
+llm_tokens = Counter("story_llm_tokens_total", "LLM tokens by node and kind (input, cache_read, cache_write, output)")
+
+
+@contextmanager
+def timed(histogram: Histogram, span: str, **labels):
+    """
+    Time a block into `histogram` and add it to the current turn's spans.
+    Yields the span record, which annotate() can add fields (e.g. tokens) to.
+    """
+    record = {"span": span}
+    parent = _span.get()
+    _span.set(record)
+    started = time.perf_counter()
+    try:
+        yield record
+    finally:
+        elapsed = time.perf_counter() - started
+        _span.set(parent)
+        histogram.observe(elapsed, **labels)
+        record["ms"] = round(elapsed * 1000, 1)
+        turn = _turn.get()
+        if turn is not None:
+            turn["spans"].append(record)
+
+
+def annotate(**fields):
+    """Add fields to the innermost open span, if any."""
+    record = _span.get()
+    if record is not None:
+        record.update(fields)
+
+
+@asynccontextmanager
+async def turn_trace(thread_id: str, endpoint: str):
+    """
+    Collect the spans of one turn and print them as a single log line.
+    Nodes run in tasks that inherit this context, so their spans land here.
+    """
+    turn = {"thread_id": thread_id, "endpoint": endpoint, "spans": []}
+    parent = _turn.get()
+    _turn.set(turn)
+    started = time.perf_counter()
+    try:
+        yield turn
+    finally:
+        elapsed = time.perf_counter() - started
+        _turn.set(parent)
+        turn_seconds.observe(elapsed, endpoint=endpoint)
+        turn["total_ms"] = round(elapsed * 1000, 1)
+        print(f"turn_metrics {json.dumps(turn, default=str)}")
@@ -1,7 +1,7 @@
 # models.py
 
 from pydantic import BaseModel
-from typing import List
+from typing import List, Optional
 
 class StoryInput(BaseModel):
     theme: str
@@ -11,3 +11,4 @@ class StoryInput(BaseModel):
 class ContinueStoryInput(BaseModel):
     story_id: str
     improv: str
+    turn: Optional[int] = None  # Improvisation number this request should produce; lets retries hit the response cache
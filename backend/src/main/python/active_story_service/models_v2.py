@@ -8,6 +8,14 @@ class StoryTurnRequest(BaseModel):
     thread_id: str
     user_text: str
     theme: Optional[str] = None  # Only used for display, user_text is the actual input
+    defer_extraction: Optional[bool] = None  # Run the Extractor in the background (default: V2_DEFER_EXTRACTION)
+    turn: Optional[int] = None  # Turn number this request should produce; lets retries hit the response cache
+    idempotency_key: Optional[str] = None  # Retries with the same key reuse the first result (or Idempotency-Key header)
+
+
+class WorldPrewarmRequest(BaseModel):
+    """Request model for speculative world building while the user types."""
+    theme: str
 
 
 class StoryTurnResponse(BaseModel):
@@ -27,5 +35,7 @@ class StoryListItem(BaseModel):
     theme: str
     content_preview: str
     turn: int
+    phase: Optional[str] = None
     tension: Optional[str] = None
     created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
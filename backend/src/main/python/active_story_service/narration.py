@@ -0,0 +1,144 @@
+"""
+Sentence-level narration pipelined with story generation.
+
+The story text is split into sentences as tokens arrive, and each finished
+sentence is sent to TTS right away while the LLM keeps writing. Events come
+back in story order:
+
+- {"index": i, "text": sentence} as soon as the sentence is complete
+- {"index": i, "audio": base64 mp3} once its audio (and all earlier audio)
+  is ready, or {"index": i, "audio_error": ...} if TTS failed
+
+so the child hears the first sentence about one sentence's TTS latency
+after it was written.
+
+Config: NARRATION_MIN_CHARS (short sentences are merged with the next),
+NARRATION_TTS_CONCURRENCY (TTS calls in flight per story).
+"""
+import asyncio
+import base64
+import os
+import re
+from collections import deque
+from typing import AsyncIterator, List
+
+from active_story_service import tts
+
+NARRATION_MIN_CHARS = int(os.getenv("NARRATION_MIN_CHARS", "40"))
+NARRATION_TTS_CONCURRENCY = int(os.getenv("NARRATION_TTS_CONCURRENCY", "4"))
+
+# End punctuation, optional closing quotes/brackets, then whitespace
+_SENTENCE_END = re.compile(r"[.!?…]+[\"'”’)\]]*\s+")
+
+
+class SentenceSplitter:
+    """Accumulates streamed text and returns sentences as they complete."""
+
+    def __init__(self, min_chars: int = NARRATION_MIN_CHARS):
+        self.min_chars = min_chars
+        self._buffer = ""
+
+    def feed(self, text: str) -> List[str]:
+        self._buffer += text
+        sentences = []
+        start = 0
+        for match in _SENTENCE_END.finditer(self._buffer):
+            if match.end() - start < self.min_chars:
+                continue
+            sentences.append(self._buffer[start:match.end()].strip())
+            start = match.end()
+        self._buffer = self._buffer[start:]
+        return sentences
+
+    def flush(self) -> List[str]:
+        rest, self._buffer = self._buffer.strip(), ""
+        return [rest] if rest else []
+
+
+class TagFilter:
+    """
+    Passes through only the text inside <tag>...</tag> of a token stream,
+    even when the tags are split across chunks.
+    """
+
+    def __init__(self, tag: str):
+        self.open_tag = f"<{tag}>"
+        self.close_tag = f"</{tag}>"
+        self._buffer = ""
+        self._inside = False
+        self._closed = False
+
+    def feed(self, text: str) -> str:
+        if self._closed:
+            return ""
+        self._buffer += text
+        if not self._inside:
+            start = self._buffer.find(self.open_tag)
+            if start < 0:
+                # Keep a possible partial opening tag
+                self._buffer = self._buffer[-(len(self.open_tag) - 1):]
+                return ""
+            self._inside = True
+            self._buffer = self._buffer[start + len(self.open_tag):]
+        end = self._buffer.find(self.close_tag)
+        if end >= 0:
+            self._closed = True
+            out, self._buffer = self._buffer[:end], ""
+            return out
+        # Hold back anything that could be the start of the closing tag
+        safe = max(0, len(self._buffer) - (len(self.close_tag) - 1))
+        out, self._buffer = self._buffer[:safe], self._buffer[safe:]
+        return out
+
+    def flush(self) -> str:
+        out = self._buffer if self._inside and not self._closed else ""
+        self._buffer = ""
+        return out
+
+
+async def _speak(text: str, semaphore: asyncio.Semaphore) -> bytes:
+    async with semaphore:
+        return await tts.synthesize(text)
+
+
+async def narrate(chunks: AsyncIterator[str]) -> AsyncIterator[dict]:
+    """
+    Turn a stream of story text into ordered text and audio events.
+    Closes `chunks` when done, including when the consumer stops early.
+    """
+    splitter = SentenceSplitter()
+    semaphore = asyncio.Semaphore(NARRATION_TTS_CONCURRENCY)
+    pending = deque()
+    index = 0
+
+    def start(sentence: str) -> dict:
+        nonlocal index
+        pending.append((index, asyncio.create_task(_speak(sentence, semaphore))))
+        index += 1
+        return {"index": index - 1, "text": sentence}
+
+    async def audio_event(i: int, task: asyncio.Task) -> dict:
+        try:
+            return {"index": i, "audio": base64.b64encode(await task).decode("ascii")}
+        except Exception as e:
+            print(f"Narration TTS failed for sentence {i}: {e}")
+            return {"index": i, "audio_error": str(e)}
+
+    try:
+        async for chunk in chunks:
+            for sentence in splitter.feed(chunk):
+                yield start(sentence)
+            # Release audio that is ready, without waiting on the rest
+            while pending and pending[0][1].done():
+                yield await audio_event(*pending.popleft())
+        for sentence in splitter.flush():
+            yield start(sentence)
+        while pending:
+            yield await audio_event(*pending.popleft())
+    finally:
+        # Also runs when the client goes away mid-story: stop paying for
+        # audio nobody will hear and close the LLM stream feeding us
+        for _, task in pending:
+            task.cancel()
+        if hasattr(chunks, "aclose"):
+            await chunks.aclose()
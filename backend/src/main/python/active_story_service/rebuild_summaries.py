@@ -0,0 +1,28 @@
+"""
+Rebuild the story_summaries collection from the LangGraph checkpoints.
+
+Usage (from backend/src/main/python):
+    python -m active_story_service.rebuild_summaries [--batch-size 500]
+"""
+import argparse
+import asyncio
+
+from active_story_service import mongo
+from active_story_service.db_crud import ensure_indexes, rebuild_story_summaries
+
+
+async def main(batch_size: int):
+    await mongo.connect()
+    try:
+        await ensure_indexes()
+        written = await rebuild_story_summaries(batch_size=batch_size)
+        print(f"Rebuilt {written} story summaries")
+    finally:
+        mongo.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+    asyncio.run(main(args.batch_size))
@@ -0,0 +1,50 @@
+"""
+Short-lived response cache for story turns.
+
+Mobile clients retry /story/turn and /continue-story/ on flaky networks.
+Without this, each retry calls the LLM again and advances the story. A
+finished turn's response is kept under (endpoint, thread, turn, hash of the
+input), so only a request naming the same turn number hits. A request
+without a turn number is never served from here: the same line typed again
+on a later turn is a new turn, not a retry (V2 clients can send an
+Idempotency-Key instead, see turn_coordinator).
+
+Config: RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL (seconds, default 120).
+"""
+import hashlib
+import os
+from typing import Any, Optional
+
+from active_story_service.ttl_cache import TTLCache
+
+_cache = TTLCache(
+    maxsize=int(os.getenv("RESPONSE_CACHE_SIZE", "2048")),
+    ttl=float(os.getenv("RESPONSE_CACHE_TTL", "120")),
+)
+
+
+def input_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def get_cached_turn(endpoint: str, thread_id: str, user_text: str, turn: Optional[int] = None) -> Optional[Any]:
+    """The stored response if this request repeats a finished turn, else None."""
+    if turn is None:
+        return None
+    return _cache.get((endpoint, thread_id, turn, input_hash(user_text)))
+
+
+def store_turn(endpoint: str, thread_id: str, user_text: str, turn: int, response: Any):
+    """Remember a finished turn. `turn` is the turn number the response produced."""
+    _cache.set((endpoint, thread_id, turn, input_hash(user_text)), response)
+
+
+def forget_thread(endpoint: str, thread_id: str):
+    """Drop a thread's cached turns, e.g. when the story is deleted."""
+    for key in _cache.keys():
+        if key[:2] == (endpoint, thread_id):
+            _cache.pop(key)
+
+
+def get_response_cache_stats() -> dict:
+    return _cache.stats()
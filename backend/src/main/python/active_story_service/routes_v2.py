@@ -7,16 +7,30 @@ Uses LangGraph with a simple prose-graph state:
 - Extractor: updates state from what was written
 """
 
-from typing import List
-from fastapi import APIRouter, HTTPException
+import json
+import os
+import time
+from typing import List, Optional
+from fastapi import APIRouter, Header, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
 
-from active_story_service.models_v2 import StoryTurnRequest, StoryTurnResponse, StoryListItem
+from active_story_service.models_v2 import StoryTurnRequest, StoryTurnResponse, StoryListItem, WorldPrewarmRequest
 from active_story_service.db_crud import (
-    get_latest_checkpoint, get_all_story_threads, delete_thread_checkpoints,
-    reconstruct_content
+    get_latest_checkpoint, delete_thread_checkpoints, reconstruct_content,
+    extract_theme_from_messages, build_story_summary, upsert_story_summary,
+    get_story_summaries, append_story_segment, get_story_transcript
 )
 from active_story_service.app.graph import build_graph
+from active_story_service.app.nodes import STORY_TOKEN_EVENT, get_phase_for_turn, build_world
+from active_story_service.app.world_cache import prewarm, get_world_cache_stats
+from active_story_service.app.extraction import schedule_extraction, settle_thread, ExtractionFailedError
+from active_story_service.response_cache import get_cached_turn, store_turn, forget_thread
+from active_story_service.app.turn_coordinator import run_turn, thread_turn, TurnBusyError
+from active_story_service.app.admission import LLMOverloadedError
+from active_story_service.app.deadlines import turn_deadline
 from active_story_service.app.state import initial_state
+from active_story_service.app.reducers import COMPACT_STATE
+from active_story_service.metrics import turn_trace, stream_ttft_seconds
 
 # Create router for V2 endpoints
 router = APIRouter(tags=["V2 Stories"])
@@ -24,66 +38,152 @@ router = APIRouter(tags=["V2 Stories"])
 # Initialize the LangGraph agent
 graph = build_graph()
 
+# Same graph, paused before the Extractor; extraction is finished in the background
+deferred_graph = build_graph(defer_extraction=True)
 
-@router.post("/story/turn", response_model=StoryTurnResponse)
-async def story_turn(req: StoryTurnRequest):
+
+async def _save_summary(thread_id: str, values: dict):
+    """Refresh the thread's story_summaries entry. Never fails the turn."""
+    try:
+        await upsert_story_summary(build_story_summary(thread_id, values))
+    except Exception as e:
+        print(f"Failed to save story summary for {thread_id}: {e}")
+
+
+def _defer_extraction(req: StoryTurnRequest) -> bool:
+    if req.defer_extraction is not None:
+        return req.defer_extraction
+    return os.getenv("V2_DEFER_EXTRACTION", "0") == "1"
+
+
+def _build_turn_response(thread_id: str, result: dict, extraction_pending: bool = False) -> StoryTurnResponse:
     """
-    V2 Story Turn Endpoint - handles both initial story and continuations.
+    Build the turn response from the graph's final state values.
+    With extraction_pending, the state is from before the Extractor ran, so
+    turn, phase and content are projected from the new segment instead.
     """
-    try:
-        # Only pass the new message - LangGraph loads previous state from checkpoint
-        # The graph's conditional routing will run WorldBuilder on turn 1 (no setting)
-        # and skip to Storyteller on turn 2+ (setting exists)
-        result = await graph.ainvoke(
-            {"messages": [{"role": "user", "content": req.user_text}]},
-            config={"configurable": {"thread_id": req.thread_id}}
-        )
-
-        # Extract the latest assistant message (the new story segment)
-        last_ai = None
-        messages = result.get("messages", [])
+    # Extract the latest assistant message (the new story segment)
+    last_ai = None
+    messages = result.get("messages", [])
+    for msg in reversed(messages):
+        msg_type = msg.get("type") if isinstance(msg, dict) else getattr(msg, "type", None)
+        if msg_type == "ai":
+            last_ai = msg
+            break
+
+    # Extract content from message object or dict
+    if last_ai:
+        story_text = last_ai.get("content", "") if isinstance(last_ai, dict) else getattr(last_ai, "content", "")
+    else:
+        story_text = ""
+
+    # Strip common preambles that LLM sometimes adds
+    preambles = [
+        "Here is the next part of the story:\n\n",
+        "Here is the next part of the story:\n",
+        "Here is the next part of the story:",
+        "Here's the next part:\n\n",
+        "Here's the next part:\n",
+        "Here's the next part:",
+    ]
+    for preamble in preambles:
+        if story_text.startswith(preamble):
+            story_text = story_text[len(preamble):].strip()
+            break
+
+    # Get story state and phase
+    story_state = result.get("story_state", {})
+    phase = result.get("phase", "setup")
+    turn = result.get("turn", 1)
+
+    # Full content is in story_so_far
+    content = story_state.get("story_so_far", story_text)
+
+    if extraction_pending:
+        # The Extractor will append this segment and advance the turn
+        turn = turn + 1
+        content = f"{content}\n\n{story_text}" if content else story_text
+        user_text = ""
         for msg in reversed(messages):
             msg_type = msg.get("type") if isinstance(msg, dict) else getattr(msg, "type", None)
-            if msg_type == "ai":
-                last_ai = msg
+            if msg_type == "human":
+                user_text = msg.get("content", "") if isinstance(msg, dict) else getattr(msg, "content", "")
                 break
+        phase = get_phase_for_turn(turn, user_text)
+
+    return StoryTurnResponse(
+        thread_id=thread_id,
+        story_text=story_text,
+        content=content,
+        turn=turn,
+        phase=phase,
+        story_state=story_state,
+        tension=story_state.get("tension")
+    )
+
+
+async def _finish_turn(thread_id: str, user_text: str, values: dict, extraction_pending: bool) -> StoryTurnResponse:
+    """
+    Build the response and record the turn outside the graph state:
+    the transcript segment and the story summary.
+    """
+    response = _build_turn_response(thread_id, values, extraction_pending=extraction_pending)
+    try:
+        await append_story_segment(thread_id, response.turn, user_text, response.story_text)
+        if COMPACT_STATE:
+            # story_so_far only holds the recent tail in compact mode
+            response.content = await get_story_transcript(thread_id)
+    except Exception as e:
+        print(f"Failed to save story segment for {thread_id}: {e}")
+    await _save_summary(thread_id, values)
+    return response
 
-        # Extract content from message object or dict
-        if last_ai:
-            story_text = last_ai.get("content", "") if isinstance(last_ai, dict) else getattr(last_ai, "content", "")
-        else:
-            story_text = ""
-
-        # Strip common preambles that LLM sometimes adds
-        preambles = [
-            "Here is the next part of the story:\n\n",
-            "Here is the next part of the story:\n",
-            "Here is the next part of the story:",
-            "Here's the next part:\n\n",
-            "Here's the next part:\n",
-            "Here's the next part:",
-        ]
-        for preamble in preambles:
-            if story_text.startswith(preamble):
-                story_text = story_text[len(preamble):].strip()
-                break
 
-        # Get story state and phase
-        story_state = result.get("story_state", {})
-        phase = result.get("phase", "setup")
-
-        # Full content is in story_so_far
-        content = story_state.get("story_so_far", story_text)
-
-        return StoryTurnResponse(
-            thread_id=req.thread_id,
-            story_text=story_text,
-            content=content,
-            turn=result.get("turn", 1),
-            phase=phase,
-            story_state=story_state,
-            tension=story_state.get("tension")
-        )
+@router.post("/story/turn", response_model=StoryTurnResponse)
+async def story_turn(req: StoryTurnRequest, idempotency_key: Optional[str] = Header(None)):
+    """
+    V2 Story Turn Endpoint - handles both initial story and continuations.
+    Turns on one thread run one at a time; retries sending the same
+    Idempotency-Key (header or body) get the first request's result, and
+    retries repeating a just-finished turn are served from the response cache.
+    """
+    async def run():
+        # Checked under the turn lock, so a retry racing the original waits and then hits
+        cached = get_cached_turn("story_turn", req.thread_id, req.user_text, req.turn)
+        if cached is not None:
+            print(f"V2 story turn served from response cache: thread={req.thread_id}")
+            return cached
+        with turn_deadline():
+            async with turn_trace(req.thread_id, "story_turn"):
+                # Wait for the previous turn's extraction so we never read stale story_state
+                await settle_thread(graph, req.thread_id, on_complete=_save_summary)
+
+                # Only pass the new message - LangGraph loads previous state from checkpoint
+                # The graph's conditional routing will run WorldBuilder on turn 1 (no setting)
+                # and skip to Storyteller on turn 2+ (setting exists)
+                defer = _defer_extraction(req)
+                result = await (deferred_graph if defer else graph).ainvoke(
+                    {"messages": [{"role": "user", "content": req.user_text}]},
+                    config={"configurable": {"thread_id": req.thread_id}}
+                )
+                if defer:
+                    await schedule_extraction(graph, req.thread_id, on_complete=_save_summary)
+                response = await _finish_turn(req.thread_id, req.user_text, result, extraction_pending=defer)
+                result = response.model_dump(mode="json")
+                store_turn("story_turn", req.thread_id, req.user_text, response.turn, result)
+                return result
+
+    try:
+        result = await run_turn(req.thread_id, idempotency_key or req.idempotency_key, run)
+        return StoryTurnResponse(**result)
+    except TurnBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ExtractionFailedError as e:
+        # The previous turn's state update is still pending; retrying the turn retries it
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    except LLMOverloadedError:
+        # Returned as a 503 by the app's exception handler
+        raise
     except Exception as e:
         print(f"V2 story turn error: {e}")
         import traceback
@@ -91,52 +191,87 @@ async def story_turn(req: StoryTurnRequest):
         raise HTTPException(status_code=500, detail=f"Story generation failed: {str(e)}")
 
 
+@router.post("/story/turn/stream")
+async def story_turn_stream(req: StoryTurnRequest):
+    """
+    Streaming version of /story/turn using Server-Sent Events.
+    Streams storyteller tokens as they arrive, then a final `done` event
+    carrying the same payload as StoryTurnResponse.
+    Holds the thread's turn lock for the whole stream.
+    """
+    config = {"configurable": {"thread_id": req.thread_id}}
+    defer = _defer_extraction(req)
+    turn_graph = deferred_graph if defer else graph
+
+    async def event_generator():
+        started = time.perf_counter()
+        first_token_at = None
+        try:
+            with turn_deadline():
+                async with thread_turn(req.thread_id), turn_trace(req.thread_id, "story_turn_stream"):
+                    await settle_thread(graph, req.thread_id, on_complete=_save_summary)
+
+                    async for event in turn_graph.astream_events(
+                        {"messages": [{"role": "user", "content": req.user_text}]},
+                        config=config,
+                        version="v2"
+                    ):
+                        if event["event"] == "on_custom_event" and event["name"] == STORY_TOKEN_EVENT:
+                            if first_token_at is None:
+                                first_token_at = time.perf_counter()
+                                stream_ttft_seconds.observe(first_token_at - started)
+                                print(f"V2 stream ttft thread={req.thread_id}: {(first_token_at - started) * 1000:.0f}ms")
+                            yield f"data: {json.dumps({'token': event['data']['text']})}\n\n"
+
+                    # The run has finished, so the checkpoint holds the final state
+                    snapshot = await turn_graph.aget_state(config)
+                    if defer:
+                        await schedule_extraction(graph, req.thread_id, on_complete=_save_summary)
+                    response = await _finish_turn(req.thread_id, req.user_text, snapshot.values, extraction_pending=defer)
+            yield f"data: {json.dumps({'done': True, **response.model_dump()})}\n\n"
+        except LLMOverloadedError as e:
+            print(f"V2 story turn stream shed: {e}")
+            yield f"data: {json.dumps({'error': f'Story service is busy, please retry: {e}', 'retry_after': e.retry_after})}\n\n"
+        except Exception as e:
+            print(f"V2 story turn stream error: {e}")
+            import traceback
+            traceback.print_exc()
+            yield f"data: {json.dumps({'error': f'Story generation failed: {str(e)}'})}\n\n"
+
+    return StreamingResponse(event_generator(), media_type="text/event-stream")
+
+
+@router.post("/story/prewarm", status_code=202)
+async def prewarm_world(req: WorldPrewarmRequest):
+    """
+    Start building the world for a draft theme before turn 1 arrives.
+    Turn 1 skips the WorldBuilder LLM call if the final theme matches.
+    """
+    return {"status": prewarm(req.theme, build_world)}
+
+
+@router.get("/story/prewarm/stats")
+async def prewarm_stats():
+    """Hit/miss counters for the speculative world cache."""
+    return get_world_cache_stats()
+
+
 @router.get("/stories", response_model=List[StoryListItem])
-async def get_all_v2_stories():
+async def get_all_v2_stories(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=200),
+    cursor: Optional[str] = None
+):
     """
-    List all V2 stories from the checkpoint collection.
+    List V2 stories from the story_summaries collection. Without `limit`
+    every story is returned; with it, one page at a time, and the cursor
+    for the next page is returned in the X-Next-Cursor header.
     """
     try:
-        checkpoints = await get_all_story_threads()
-        stories = []
-
-        for checkpoint in checkpoints:
-            thread_id = checkpoint.get("thread_id", "")
-            channel_values = checkpoint.get("channel_values", {})
-            story_state = channel_values.get("story_state", {})
-            turn = channel_values.get("turn", 0)
-            messages = channel_values.get("messages", [])
-
-            # Get theme from first user message (original input)
-            # Messages can be LangGraph message objects or dicts
-            theme = "Untitled Story"
-            for msg in messages:
-                # Handle LangGraph message objects (have .type attribute)
-                if hasattr(msg, 'type') and hasattr(msg, 'content'):
-                    if msg.type == "human":
-                        theme = msg.content or "Untitled Story"
-                        break
-                # Handle dict format
-                elif isinstance(msg, dict):
-                    msg_type = msg.get("type") or msg.get("role")
-                    if msg_type in ("human", "user"):
-                        theme = msg.get("content", "Untitled Story")
-                        break
-
-            # Content preview
-            content = story_state.get("story_so_far", "")
-            content_preview = content[:100] + "..." if len(content) > 100 else content
-
-            stories.append(StoryListItem(
-                thread_id=thread_id,
-                theme=theme,
-                content_preview=content_preview,
-                turn=turn,
-                tension=story_state.get("tension"),
-                created_at=None
-            ))
-
-        return stories
+        page = await get_story_summaries(limit=limit, cursor=cursor)
+        if page["next_cursor"]:
+            response.headers["X-Next-Cursor"] = page["next_cursor"]
+        return [StoryListItem(**summary) for summary in page["stories"]]
     except Exception as e:
         print(f"Error fetching V2 stories: {e}")
         import traceback
@@ -160,21 +295,12 @@ async def get_v2_story(thread_id: str):
         turn = channel_values.get("turn", 0)
         messages = channel_values.get("messages", [])
 
-        # Get theme from first user message (original input)
-        # Messages can be LangGraph message objects or dicts
-        theme = "Untitled Story"
-        for msg in messages:
-            # Handle LangGraph message objects (have .type attribute)
-            if hasattr(msg, 'type') and hasattr(msg, 'content'):
-                if msg.type == "human":
-                    theme = msg.content or "Untitled Story"
-                    break
-            # Handle dict format
-            elif isinstance(msg, dict):
-                msg_type = msg.get("type") or msg.get("role")
-                if msg_type in ("human", "user"):
-                    theme = msg.get("content", "Untitled Story")
-                    break
+        theme = story_state.get("theme") or extract_theme_from_messages(messages)
+
+        # In compact mode story_so_far is only the recent tail; the full story is in the transcript
+        content = story_state.get("story_so_far", "")
+        if COMPACT_STATE:
+            content = await get_story_transcript(thread_id) or content
 
         return {
             "thread_id": thread_id,
@@ -182,7 +308,7 @@ async def get_v2_story(thread_id: str):
             "phase": channel_values.get("phase", "setup"),
             "theme": theme,
             "story_state": story_state,
-            "content": story_state.get("story_so_far", ""),
+            "content": content,
             "tension": story_state.get("tension"),
             "messages": messages
         }
@@ -202,6 +328,7 @@ async def delete_v2_story(thread_id: str):
     """
     try:
         success = await delete_thread_checkpoints(thread_id)
+        forget_thread("story_turn", thread_id)
         if not success:
             raise HTTPException(status_code=404, detail="Story not found")
         return {"message": "Story deleted successfully"}
@@ -0,0 +1,113 @@
+"""
+Deepgram text-to-speech client.
+
+Audio is relayed to the client chunk by chunk as Deepgram produces it, so
+playback starts after the first chunk instead of after the whole MP3. The
+stream is teed into the audio cache and only committed once it completes.
+
+Config: DEEPGRAM_API_KEY, TTS_MAX_CONNECTIONS, TTS_TIMEOUT
+"""
+import os
+import time
+from typing import AsyncIterator
+
+import aiofiles
+import httpx
+
+from active_story_service import audio_cache
+from active_story_service.metrics import tts_first_byte_seconds
+
+# Deepgram Aura 2 - Thalia voice (expressive storytelling)
+TTS_MODEL = "aura-2-thalia-en"
+DEEPGRAM_URL = f"https://api.deepgram.com/v1/speak?model={TTS_MODEL}"
+
+_http_client = None
+
+
+def get_tts_client() -> httpx.AsyncClient:
+    """Shared keep-alive client for Deepgram, created on first use."""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            timeout=float(os.getenv("TTS_TIMEOUT", "30")),
+            limits=httpx.Limits(max_connections=int(os.getenv("TTS_MAX_CONNECTIONS", "20"))),
+        )
+    return _http_client
+
+
+async def close_tts_client():
+    """Close the shared client. Called on app shutdown."""
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+
+async def open_speech(text: str) -> httpx.Response:
+    """
+    Send the TTS request and wait for the response headers only.
+    Raises on an error status, before any audio reaches the client.
+    """
+    request = get_tts_client().build_request(
+        "POST",
+        DEEPGRAM_URL,
+        headers={
+            "Authorization": f"Token {os.environ.get('DEEPGRAM_API_KEY')}",
+            "Content-Type": "text/plain"  # Send as plain text, not JSON
+        },
+        content=text,
+    )
+    response = await get_tts_client().send(request, stream=True)
+    if response.is_error:
+        await response.aread()
+        await response.aclose()
+        response.raise_for_status()
+    return response
+
+
+async def relay_speech(response: httpx.Response, key: str, started: float) -> AsyncIterator[bytes]:
+    """
+    Yield audio chunks from an open Deepgram response, writing them to the
+    audio cache as they pass. A stream that fails or is abandoned by the
+    client is discarded rather than cached.
+    """
+    writer = audio_cache.AudioCacheWriter(key)
+    first_chunk = True
+    completed = False
+    try:
+        async for chunk in response.aiter_bytes():
+            if first_chunk:
+                first_chunk = False
+                tts_first_byte_seconds.observe(time.perf_counter() - started)
+            if writer is not None:
+                try:
+                    await writer.write(chunk)
+                except Exception as e:
+                    # Caching is best effort; keep streaming to the client
+                    print(f"Failed to cache TTS audio: {e}")
+                    await writer.abort()
+                    writer = None
+            yield chunk
+        completed = True
+    finally:
+        await response.aclose()
+        if writer is not None:
+            try:
+                if completed:
+                    await writer.commit()
+                else:
+                    await writer.abort()
+            except Exception as e:
+                print(f"Failed to cache TTS audio: {e}")
+
+
+async def synthesize(text: str) -> bytes:
+    """Complete audio for `text`, from the audio cache when possible."""
+    key = audio_cache.audio_key(TTS_MODEL, text)
+    cached_path = await audio_cache.lookup(key)
+    if cached_path:
+        async with aiofiles.open(cached_path, "rb") as f:
+            return await f.read()
+    started = time.perf_counter()
+    response = await open_speech(text)
+    return b"".join([chunk async for chunk in relay_speech(response, key, started)])
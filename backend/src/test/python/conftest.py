@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Tests import the service the same way uvicorn does, from backend/src/main/python
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "main", "python"))
@@ -0,0 +1,141 @@
+import asyncio
+
+from langgraph.checkpoint.base import empty_checkpoint
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+
+from active_story_service.app.checkpointer import MotorSaver
+
+
+def _matches(doc, query):
+    for key, expected in query.items():
+        value = doc
+        for part in key.split("."):
+            value = value.get(part) if isinstance(value, dict) else None
+        if isinstance(expected, dict) and "$lt" in expected:
+            if value is None or not value < expected["$lt"]:
+                return False
+        elif value != expected:
+            return False
+    return True
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def sort(self, key, direction=None):
+        keys = key if isinstance(key, list) else [(key, direction)]
+        for field, order in reversed(keys):
+            self.docs.sort(key=lambda d: d[field], reverse=order == -1)
+        return self
+
+    def limit(self, n):
+        self.docs = self.docs[:n] if n else self.docs
+        return self
+
+    def __aiter__(self):
+        return self._iter()
+
+    async def _iter(self):
+        for doc in self.docs:
+            yield doc
+
+
+class FakeCollection:
+    """Just enough of a Motor collection for MotorSaver."""
+
+    def __init__(self):
+        self.docs = []
+
+    def find(self, query):
+        return FakeCursor([d for d in self.docs if _matches(d, query)])
+
+    async def find_one(self, query, sort=None):
+        cursor = self.find(query)
+        if sort:
+            cursor.sort(sort)
+        return cursor.docs[0] if cursor.docs else None
+
+    async def update_one(self, query, update, upsert=False):
+        doc = next((d for d in self.docs if _matches(d, query)), None)
+        if doc is None:
+            doc = dict(query)
+            self.docs.append(doc)
+            doc.update(update.get("$setOnInsert", {}))
+        doc.update(update.get("$set", {}))
+
+    async def bulk_write(self, operations, ordered=True):
+        for op in operations:
+            await self.update_one(op._filter, op._doc, upsert=op._upsert)
+
+    async def delete_many(self, query):
+        self.docs = [d for d in self.docs if not _matches(d, query)]
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.collections = {}
+
+    def get_collection(self, name):
+        return self.collections.setdefault(name, FakeCollection())
+
+
+def make_saver():
+    db = FakeDatabase()
+    return MotorSaver(lambda: db, serde=JsonPlusSerializer())
+
+
+def config(thread_id, checkpoint_id=None):
+    configurable = {"thread_id": thread_id, "checkpoint_ns": ""}
+    if checkpoint_id:
+        configurable["checkpoint_id"] = checkpoint_id
+    return {"configurable": configurable}
+
+
+def new_checkpoint(turn):
+    checkpoint = empty_checkpoint()
+    checkpoint["channel_values"] = {"turn": turn, "story_state": {"tension": "a storm"}}
+    return checkpoint
+
+
+def test_put_then_get_round_trip():
+    async def run():
+        saver = make_saver()
+        checkpoint = new_checkpoint(1)
+        metadata = {"source": "loop", "step": 1, "parents": {}}
+        saved = await saver.aput(config("t1"), checkpoint, metadata, {})
+        await saver.aput_writes(saved, [("messages", ["hi"]), ("turn", 2)], task_id="task-1")
+
+        loaded = await saver.aget_tuple(config("t1"))
+        assert loaded.config == saved
+        assert loaded.checkpoint["channel_values"] == checkpoint["channel_values"]
+        assert loaded.metadata == metadata
+        assert loaded.parent_config is None
+        assert loaded.pending_writes == [("task-1", "messages", ["hi"]), ("task-1", "turn", 2)]
+    asyncio.run(run())
+
+
+def test_latest_checkpoint_and_list():
+    async def run():
+        saver = make_saver()
+        first = await saver.aput(config("t1"), new_checkpoint(1), {"step": 1}, {})
+        second = await saver.aput(first, new_checkpoint(2), {"step": 2}, {})
+        await saver.aput(config("other"), new_checkpoint(9), {"step": 1}, {})
+
+        latest = await saver.aget_tuple(config("t1"))
+        assert latest.config == second
+        assert latest.parent_config == {"configurable": first["configurable"]}
+        older = await saver.aget_tuple(first)
+        assert older.checkpoint["channel_values"]["turn"] == 1
+
+        listed = await collect(saver.alist(config("t1")))
+        assert [t.metadata["step"] for t in listed] == [2, 1]
+        assert [t.config for t in await collect(saver.alist(config("t1"), before=second))] == [first]
+        assert len(await collect(saver.alist(config("t1"), limit=1))) == 1
+        # Metadata filters match the stored (serialized) values
+        assert len(await collect(saver.alist(None, filter={"step": 1}))) == 2
+    asyncio.run(run())
+
+
+async def collect(iterator):
+    return [item async for item in iterator]
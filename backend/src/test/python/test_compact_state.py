@@ -0,0 +1,50 @@
+import asyncio
+import json
+
+from active_story_service.app import nodes, reducers
+
+
+def test_merge_relationships_keeps_mention_order(monkeypatch):
+    monkeypatch.setattr(reducers, "COMPACT_STATE", False)
+    merged = reducers.merge_relationships(["a", "b", "c"], ["b", "d", "d"])
+    assert merged == ["a", "c", "b", "d"]
+
+
+def test_merge_relationships_window(monkeypatch):
+    monkeypatch.setattr(reducers, "COMPACT_STATE", True)
+    monkeypatch.setattr(reducers, "RELATIONSHIP_WINDOW", 3)
+    assert reducers.merge_relationships(["a", "b", "c"], ["d", "e"]) == ["c", "d", "e"]
+
+
+def test_story_state_stays_bounded_over_many_turns(monkeypatch):
+    monkeypatch.setattr(reducers, "COMPACT_STATE", True)
+    monkeypatch.setattr(nodes, "COMPACT_STATE", True)
+
+    async def fake_llm(system, messages, **kwargs):
+        turn = fake_llm.calls = getattr(fake_llm, "calls", 0) + 1
+        return json.dumps({
+            "characters": [{"name": "Owl", "feeling": f"brave {turn}"}],
+            "relationships": [f"Owl helped friend number {turn}", f"Badger thanked Owl on day {turn}"],
+            "tension": f"the storm on day {turn}",
+        })
+
+    monkeypatch.setattr(nodes, "llm_messages", fake_llm)
+
+    async def run():
+        state = {"story_state": {"characters": [], "relationships": [], "story_so_far": ""}, "turn": 1}
+        sizes = []
+        for turn in range(60):
+            state["messages"] = [
+                {"type": "human", "content": f"what happens on day {turn}"},
+                {"type": "ai", "content": f"On day {turn} the owl flew over the wood. " * 20},
+            ]
+            result = await nodes.extractor_node(state)
+            state = {**state, **result}
+            sizes.append(len(json.dumps(state["story_state"])))
+        return state, sizes
+
+    state, sizes = asyncio.run(run())
+    assert len(state["story_state"]["relationships"]) == reducers.RELATIONSHIP_WINDOW
+    assert state["story_state"]["relationships"][-1] == "Badger thanked Owl on day 60"
+    # Once the windows are full, the state stops growing with the story
+    assert max(sizes[30:]) - min(sizes[30:]) < 50
@@ -0,0 +1,108 @@
+from active_story_service.app.json_parsing import (
+    extract_json,
+    parse_partial_json,
+    parse_updates,
+    parse_world,
+)
+
+
+def test_partial_json_complete_object():
+    value, complete = parse_partial_json('{"a": 1, "b": "x"}')
+    assert value == {"a": 1, "b": "x"}
+    assert complete == {"a", "b"}
+
+
+def test_partial_json_cuts_at_last_complete_value():
+    value, complete = parse_partial_json('{"setting": "a wood", "characters": [{"name": "Owl"}, {"na')
+    assert value == {"setting": "a wood", "characters": [{"name": "Owl"}]}
+    assert complete == {"setting"}
+
+
+def test_partial_json_bare_literals():
+    value, complete = parse_partial_json('{"n": 3, "ok": true, "t": nu')
+    assert value == {"n": 3, "ok": True}
+    assert complete == {"n", "ok"}
+
+
+def test_partial_json_trailing_literals_before_brace():
+    assert parse_partial_json('{"a": "x", "n": 3}') == ({"a": "x", "n": 3}, {"a", "n"})
+    assert parse_partial_json('{"a":"x","t":null}') == ({"a": "x", "t": None}, {"a", "t"})
+    assert parse_partial_json('{"ok": true}')[1] == {"ok"}
+    assert parse_partial_json('{"ok": false\n}')[1] == {"ok"}
+
+
+def test_partial_json_whitespace_padded_literals():
+    value, complete = parse_partial_json('{"n": 3 , "m": "x"')
+    assert value == {"n": 3, "m": "x"}
+    assert complete == {"n", "m"}
+    value, complete = parse_partial_json('{"t": null , "f": false , "x": -1.5e3 ,"y": "cut')
+    assert value == {"t": None, "f": False, "x": -1500.0}
+    assert complete == {"t", "f", "x"}
+
+
+def test_partial_json_literal_cut_off_is_incomplete():
+    # 3 could still become 35
+    assert parse_partial_json('{"a": "x", "n": 3') == ({"a": "x"}, {"a"})
+
+
+def test_extract_json_keeps_complete_literals():
+    value, repaired = extract_json('{"turn": 4, "happy": true, "tension": null, "characters": [{"na')
+    assert value == {"turn": 4, "happy": True, "tension": None}
+    assert repaired
+
+
+def test_partial_json_no_object():
+    assert parse_partial_json("no json here") == (None, set())
+    assert parse_partial_json('{"tension": "hi') == (None, set())
+
+
+def test_extract_json_ignores_fence_and_preamble():
+    value, repaired = extract_json('Sure!\n```json\n{"tension": "a storm"}\n```')
+    assert value == {"tension": "a storm"}
+    assert not repaired
+
+
+def test_extract_json_keeps_only_complete_keys():
+    value, repaired = extract_json('{"relationships": ["Owl likes Badger"], "characters": [{"name": "Owl"}')
+    assert value == {"relationships": ["Owl likes Badger"]}
+    assert repaired
+
+
+def test_updates_full_reply():
+    updates = parse_updates('{"characters": [{"name": "Owl", "feeling": "brave"}], "relationships": [], "tension": "dark"}')
+    assert updates["tension"] == "dark"
+    assert updates["characters"][0]["name"] == "Owl"
+
+
+def test_updates_missing_tension_is_left_out():
+    updates = parse_updates('{"characters": [{"name": "Owl"}]}')
+    assert "tension" not in updates
+    assert "relationships" not in updates
+
+
+def test_updates_explicit_null_tension_is_kept():
+    assert parse_updates('{"tension": null}') == {"tension": None}
+
+
+def test_updates_truncated_before_tension():
+    # Cut off by max_tokens: tension never arrived, so it must not come back as None
+    updates = parse_updates('{"characters": [{"name": "Owl", "who": "a little owl"}], "relationships": ["Owl and Bad')
+    assert updates == {"characters": [{"name": "Owl", "who": "a little owl", "feeling": "", "wants": ""}]}
+
+
+def test_updates_truncated_inside_characters():
+    # A half-built character list must not replace the old one
+    updates = parse_updates('{"tension": "storm", "characters": [{"name": "Owl"}, {"name": "Bad')
+    assert updates == {"tension": "storm"}
+
+
+def test_updates_invalid_reply():
+    assert parse_updates("I can't do that") is None
+    assert parse_updates('{"characters": "Owl"}') is None
+
+
+def test_world_needs_complete_characters():
+    assert parse_world('{"setting": "a wood", "characters": [{"name": "Owl"}, {"na') is None
+    world = parse_world('{"setting": "a wood", "characters": [{"name": "Owl"}]}')
+    assert world["setting"] == "a wood"
+    assert world["tension"] is None
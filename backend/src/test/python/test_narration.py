@@ -0,0 +1,69 @@
+from active_story_service.narration import SentenceSplitter, TagFilter
+
+
+def feed_all(splitter, chunks):
+    sentences = []
+    for chunk in chunks:
+        sentences.extend(splitter.feed(chunk))
+    return sentences + splitter.flush()
+
+
+def test_splitter_waits_for_whitespace_after_punctuation():
+    splitter = SentenceSplitter(min_chars=0)
+    assert splitter.feed("The owl hooted.") == []
+    assert splitter.feed(" Then") == ["The owl hooted."]
+    assert splitter.flush() == ["Then"]
+
+
+def test_splitter_handles_sentences_split_across_chunks():
+    chunks = ["Once upon a ti", "me there was an owl! She ", "was small. ", "The end"]
+    assert feed_all(SentenceSplitter(min_chars=0), chunks) == [
+        "Once upon a time there was an owl!", "She was small.", "The end"
+    ]
+
+
+def test_splitter_keeps_closing_quotes_with_the_sentence():
+    assert feed_all(SentenceSplitter(min_chars=0), ['"Hello!" said Owl. Bye']) == [
+        '"Hello!"', "said Owl.", "Bye"
+    ]
+
+
+def test_splitter_merges_short_sentences():
+    assert feed_all(SentenceSplitter(min_chars=20), ["Hi. Oh. The owl flew far away. Yes"]) == [
+        "Hi. Oh. The owl flew far away.", "Yes"
+    ]
+
+
+def test_splitter_flush_empty():
+    splitter = SentenceSplitter()
+    assert splitter.flush() == []
+    assert splitter.feed("   ") == []
+    assert splitter.flush() == []
+
+
+def filter_all(tag_filter, chunks):
+    return "".join(tag_filter.feed(c) for c in chunks) + tag_filter.flush()
+
+
+def test_tag_filter_passes_only_tag_contents():
+    text = "<story_planning>plan</story_planning><story>Once upon a time.</story> after"
+    assert filter_all(TagFilter("story"), [text]) == "Once upon a time."
+
+
+def test_tag_filter_tags_split_across_chunks():
+    chunks = ["<sto", "ry>Once up", "on a time.</st", "ory> ignored <story>again</story>"]
+    assert filter_all(TagFilter("story"), chunks) == "Once upon a time."
+
+
+def test_tag_filter_streams_before_the_closing_tag():
+    tag_filter = TagFilter("story")
+    assert tag_filter.feed("<story>Once upon a time") == "Once upon"
+    assert tag_filter.feed("</story>") == " a time"
+
+
+def test_tag_filter_unclosed_tag_flushes_rest():
+    assert filter_all(TagFilter("story"), ["<story>Once upon a ti", "me"]) == "Once upon a time"
+
+
+def test_tag_filter_no_tag():
+    assert filter_all(TagFilter("story"), ["no tags here"]) == ""